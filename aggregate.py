@@ -0,0 +1,102 @@
+import pandas as pd
+
+# Summary sheet label -> source column in the processed chassis data
+SUMMARY_MEASURES = {
+    'QTY': 'COUNT',
+    'SALE-PUR DIFF': 'purchase -sales',
+    'Additional Discount': 'AdditionalDiscount ',
+    'Additional Accessories Discount': 'AdditionalFreeAcc(-) ',
+    'DSA Commission': 'DSAComission(-)',
+    'Dlr share in Retail Support': 'TOTAL DLR SHARE',
+    'Net Margin': 'Margin',
+    'TATA RETAIL SUPPORT': 'TOTAL TATA SHARE',
+    'MFG share in Retail Support CREDIT IN TATA PUR': 'Tata DMS Credit',
+}
+
+# Columns of the chassis data the Difference sheet sums per Location
+DIFFERENCE_COLUMNS = ['Sale Price(+)', 'Discount-DBT(-)', 'Purchase Price(-)', 'AdditionalDiscount ', 'TOTAL DLR SHARE',
+                      'TOTAL TATA SHARE', 'AdditionalFreeAcc(-) ', 'DSAComission(-)', 'Tata DMS Credit', 'Margin']
+
+# Every column ChassisAggregates sums
+AGGREGATED_COLUMNS = list(dict.fromkeys(list(SUMMARY_MEASURES.values()) + DIFFERENCE_COLUMNS))
+
+# Largest reconciliation difference, in rupees, that still counts as a match
+RECONCILIATION_TOLERANCE = 1.0
+
+class ChassisAggregates:
+    """The sums of the chassis data that the Summary and Difference sheets are built from.
+
+    groups holds AGGREGATED_COLUMNS summed per (Location, Model), with missing keys kept
+    as NaN groups; totals the same columns summed over all chassis rows; rows
+    the number of chassis rows. Computed once and shared by summary(), verify_data()
+    and reconcile().
+    """
+
+    def __init__(self, groups, totals, rows):
+        self.groups = groups
+        self.totals = totals
+        self.rows = rows
+
+    @classmethod
+    def from_data(cls, data):
+        # The last row of the chassis data is the totals row added by total_row()
+        rows = data.iloc[:len(data)-1]
+        values = rows[AGGREGATED_COLUMNS]
+        groups = values.groupby([rows['Location'], rows['Model']], sort=True, dropna=False, observed=True).sum()
+        return cls(groups, values.sum(), len(rows))
+
+    @property
+    def total_label(self):
+        # Location label of the totals row, as total_row() names it
+        return f'Total ({self.rows})'
+
+    def location_model(self):
+        """Summary sheet measures per (Location, Model); rows missing either key are left out"""
+        keys = self.groups.index.to_frame(index=False)
+        grouped = self.groups[keys.notna().all(axis=1).to_numpy()][list(SUMMARY_MEASURES.values())]
+        return grouped.rename(columns={src: label for label, src in SUMMARY_MEASURES.items()})
+
+    def by_location(self):
+        """AGGREGATED_COLUMNS per Location, followed by the totals of every row under total_label"""
+        locations = self.groups.groupby(level='Location', sort=True, observed=True).sum()
+        totals = pd.DataFrame([self.totals], index=pd.Index([self.total_label], name='Location'))
+        return pd.concat([locations, totals])
+
+def location_model_summary(data):
+    """Sum every Summary sheet measure per (Location, Model) in a single grouped pass"""
+    return ChassisAggregates.from_data(data).location_model()
+
+def reconcile(aggregates, tolerance=RECONCILIATION_TOLERANCE):
+    """Machine-readable form of the Difference sheet checks, per Location and in total.
+
+    discount_difference is the scheme discount (additional discount plus dealer and
+    Tata shares) minus Discount-DBT; margin_difference is sale profit plus Tata balance
+    minus Net Margin. A location matches when both are within tolerance.
+    """
+    sums = aggregates.by_location().round(0)
+    profit = sums['Sale Price(+)'] - sums['Discount-DBT(-)'] - sums['Purchase Price(-)']
+    balance = (sums['TOTAL TATA SHARE'] - sums['AdditionalFreeAcc(-) '] - sums['DSAComission(-)']
+               - sums['Tata DMS Credit'])
+    scheme_discount = sums['AdditionalDiscount '] + sums['TOTAL DLR SHARE'] + sums['TOTAL TATA SHARE']
+    checks = pd.DataFrame({
+        'discount_difference': (scheme_discount - sums['Discount-DBT(-)']).round(0),
+        'margin_difference': (profit + balance - sums['Margin']).round(0),
+    })
+    checks['ok'] = (checks[['discount_difference', 'margin_difference']].abs() <= tolerance).all(axis=1)
+
+    def entry(location, row):
+        return {
+            'location': str(location),
+            'discount_difference': float(row['discount_difference']),
+            'margin_difference': float(row['margin_difference']),
+            'ok': bool(row['ok']),
+        }
+
+    locations = [entry(location, row) for location, row in checks.iloc[:-1].iterrows()]
+    return {
+        'tolerance': tolerance,
+        'ok': bool(checks['ok'].all()),
+        'mismatched_locations': [item['location'] for item in locations if not item['ok']],
+        'locations': locations,
+        'total': entry(aggregates.total_label, checks.iloc[-1]),
+    }
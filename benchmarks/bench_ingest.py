@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from ingest import calamine_available, read_main_sheet, read_reco_sheet
+from synthetic import reco_workbook, sales_workbook
+
+def load(mode, main_path, reco_path):
+    # Runs in a fresh process so ru_maxrss belongs to this case alone
+    start = time.perf_counter()
+    if mode == 'full sheet (openpyxl)':
+        data = pd.read_excel(main_path, sheet_name='Sales', skiprows=6, engine='openpyxl')
+        reco = pd.read_excel(reco_path, sheet_name='PV', engine='openpyxl')
+    else:
+        engine = 'calamine' if 'calamine' in mode else 'openpyxl'
+        data = read_main_sheet(main_path, 'Sales', engine=engine)
+        reco = read_reco_sheet(reco_path, 'PV', engine=engine)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return elapsed, peak_mb, data.shape, reco.shape
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    modes = ['full sheet (openpyxl)', 'projected (openpyxl)']
+    if calamine_available():
+        modes.append('projected (calamine)')
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        main_path = os.path.join(tmp, 'sales.xlsx')
+        reco_path = os.path.join(tmp, 'chassis.xlsx')
+        chassis = sales_workbook(main_path, rows)
+        reco_workbook(reco_path, chassis)
+        print(f"{'mode':<24} {'rows':>8} {'load s':>8} {'peak MB':>8} {'main shape':>12}")
+        for mode in modes:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                elapsed, peak_mb, shape, _ = pool.submit(load, mode, main_path, reco_path).result()
+            print(f"{mode:<24} {rows:>8} {elapsed:>8.2f} {peak_mb:>8.1f} {str(shape):>12}")
@@ -0,0 +1,131 @@
+"""Time every pipeline stage and the whole run on synthetic dealer files.
+
+    python benchmarks/bench_pipeline.py --rows 1000 20000 100000 --out results/baseline.json
+    python benchmarks/bench_pipeline.py --rows 1000 20000 100000 --out results/branch.json
+    python benchmarks/bench_pipeline.py --compare results/baseline.json results/branch.json
+
+Workbooks are generated once per size into --data-dir and reused. Each case runs in
+a fresh process, --repeat times, and the fastest run is kept. Results are written as
+sorted, indented JSON so two runs diff cleanly.
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate
+
+def run_case(main_path, reco_path, chunk_rows=None):
+    # Runs in a fresh process so imports and caches of earlier cases do not count
+    from ingest import read_main_sheet, read_reco_sheet
+    from pipeline import process_data, write_reports
+    from profiling import StageProfiler, measure
+    from streaming import process_chunked
+
+    profiler = StageProfiler()
+    start = time.perf_counter()
+    with profiler.activate():
+        if chunk_rows:
+            sales_reco_data = read_reco_sheet(reco_path, 'PV')
+            rows, unmatched, _ = process_chunked(main_path, 'Sales', sales_reco_data, io.BytesIO(), io.BytesIO(), chunk_rows)
+        else:
+            with measure('read'):
+                data = read_main_sheet(main_path, 'Sales')
+                sales_reco_data = read_reco_sheet(reco_path, 'PV')
+            with measure('process'):
+                data, unmatched = process_data(data, sales_reco_data)
+            with measure('write'):
+                write_reports(data, io.BytesIO(), io.BytesIO())
+            rows = len(data) - 1
+    seconds = {}
+    for stage in profiler.stages:
+        seconds[stage['stage']] = round(seconds.get(stage['stage'], 0.0) + stage['seconds'], 4)
+    return {
+        'end_to_end_seconds': round(time.perf_counter() - start, 4),
+        'peak_rss_mb': profiler.peak_rss_mb,
+        'rows_out': rows,
+        'unmatched': len(unmatched),
+        'stages': seconds,
+    }
+
+def fastest(runs):
+    best = min(runs, key=lambda run: run['end_to_end_seconds'])
+    best['stages'] = {name: min(run['stages'].get(name, 0.0) for run in runs) for name in best['stages']}
+    return best
+
+def case_workbooks(args, rows):
+    # Reuse workbooks generated by an earlier run; delete --data-dir after changing the settings
+    main_path = os.path.join(args.data_dir, f'sales_{rows}.xlsx')
+    reco_path = os.path.join(args.data_dir, f'chassis_{rows}.xlsx')
+    if os.path.exists(main_path) and os.path.exists(reco_path):
+        return main_path, reco_path
+    return generate(args.data_dir, rows, args.locations, args.models, args.returns_rate,
+                    args.missing_rate, args.duplicate_rate, args.seed)
+
+def benchmark(args):
+    context = multiprocessing.get_context('spawn')
+    cases = {}
+    for rows in args.rows:
+        main_path, reco_path = case_workbooks(args, rows)
+        runs = []
+        for _ in range(args.repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                runs.append(pool.submit(run_case, main_path, reco_path, args.chunk_rows).result())
+        cases[str(rows)] = fastest(runs)
+        print(f"{rows:>8} rows  {cases[str(rows)]['end_to_end_seconds']:>8.2f}s  "
+              f"{cases[str(rows)]['peak_rss_mb']:>8.1f} MB peak")
+    return {
+        'python': platform.python_version(),
+        'settings': {key: getattr(args, key) for key in
+                     ['locations', 'models', 'returns_rate', 'missing_rate', 'duplicate_rate', 'seed', 'repeat', 'chunk_rows']},
+        'cases': cases,
+    }
+
+def compare(old_path, new_path, out=sys.stdout):
+    with open(old_path) as f:
+        old = json.load(f)['cases']
+    with open(new_path) as f:
+        new = json.load(f)['cases']
+    for rows in sorted(set(old) & set(new), key=int):
+        before, after = old[rows], new[rows]
+        print(f"\n{rows} rows", file=out)
+        print(f"{'stage':<32} {'old s':>9} {'new s':>9} {'change':>8}", file=out)
+        lines = [('end to end', before['end_to_end_seconds'], after['end_to_end_seconds'])]
+        lines += [(name, before['stages'].get(name), after['stages'].get(name))
+                  for name in sorted(set(before['stages']) | set(after['stages']))]
+        for name, old_seconds, new_seconds in lines:
+            change = f'{(new_seconds - old_seconds) / old_seconds:+.0%}' if old_seconds and new_seconds is not None else ''
+            print(f"{name:<32} {'' if old_seconds is None else f'{old_seconds:.3f}':>9} "
+                  f"{'' if new_seconds is None else f'{new_seconds:.3f}':>9} {change:>8}", file=out)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic workbooks")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000, 20_000])
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--models', type=int, default=60)
+    parser.add_argument('--returns-rate', type=float, default=0.02)
+    parser.add_argument('--missing-rate', type=float, default=0.05)
+    parser.add_argument('--duplicate-rate', type=float, default=0.02)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per size; the fastest is recorded")
+    parser.add_argument('--chunk-rows', type=int, help="Benchmark the chunked mode with this many rows per chunk")
+    parser.add_argument('--data-dir', default='synthetic_data', help="Where generated workbooks are kept between runs")
+    parser.add_argument('--out', help="Write the results to this JSON file")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="Print per-stage changes between two result files")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+    results = benchmark(args)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write('\n')
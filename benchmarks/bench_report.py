@@ -0,0 +1,36 @@
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from report import ReportBuilder, chassis_file, summary, verify_data
+from synthetic import processed_frame
+
+def write_report(rows, locations):
+    # Runs in a fresh process so ru_maxrss belongs to this case alone
+    data = processed_frame(rows, locations=locations)
+    start = time.perf_counter()
+    report = ReportBuilder()
+    chassis_file(data, report)
+    summary(data, report)
+    verify_data(data, report)
+    output = io.BytesIO()
+    report.save(output)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return elapsed, peak_mb, output.getbuffer().nbytes
+
+if __name__ == '__main__':
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    location_counts = [int(n) for n in sys.argv[2:]] or [1, 5, 10, 20, 40]
+    context = multiprocessing.get_context('spawn')
+    print(f"{'locations':>9} {'rows':>8} {'wall s':>8} {'peak MB':>8} {'xlsx MB':>8}")
+    for locations in location_counts:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            elapsed, peak_mb, size = pool.submit(write_report, rows, locations).result()
+        print(f"{locations:>9} {rows:>8} {elapsed:>8.2f} {peak_mb:>8.1f} {size / 2**20:>8.2f}")
@@ -0,0 +1,34 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregate import SUMMARY_MEASURES, location_model_summary
+from synthetic import processed_frame
+
+def per_model_masks(data):
+    # The pre-aggregate approach: one boolean mask per location, model and column
+    rows = data.iloc[:len(data)-1]
+    for location in sorted(rows['Location'].unique()):
+        show_rm = rows[rows['Location'] == location]
+        for m in sorted(show_rm['Model'].unique()):
+            for col in SUMMARY_MEASURES.values():
+                show_rm[show_rm['Model'] == m][col].sum()
+
+def timed(func, data, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == '__main__':
+    sizes = [int(n) for n in sys.argv[1:]] or [10_000, 20_000, 40_000, 80_000, 160_000]
+    print(f"{'rows':>8} {'grouped s':>10} {'us/row':>8} {'masks s':>10}")
+    for rows in sizes:
+        data = processed_frame(rows)
+        grouped = timed(location_model_summary, data)
+        masks = timed(per_model_masks, data, repeat=1) if rows <= 40_000 else float('nan')
+        print(f"{rows:>8} {grouped:>10.4f} {grouped / rows * 1e6:>8.3f} {masks:>10.4f}")
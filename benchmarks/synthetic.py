@@ -0,0 +1,139 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def processed_frame(rows, locations=20, models=60, seed=0):
+    """Build a chassis-level frame shaped like the output of total_row()"""
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'SNO': np.arange(1, rows + 1),
+        'Location': rng.choice([f'LOCATION {i:02d}' for i in range(locations)], rows),
+        'Model': rng.choice([f'MODEL {i:03d}' for i in range(models)], rows),
+        'ChassisNo': [f'MAT{i:014d}' for i in range(rows)],
+        'COUNT': rng.choice([1, 1, 1, 1, -1], rows),
+        'Sale Price(+)': rng.integers(500000, 2500000, rows).astype(float),
+        'Discount-DBT(-)': rng.integers(0, 80000, rows).astype(float),
+        'Purchase Price(-)': rng.integers(400000, 2300000, rows).astype(float),
+        'purchase -sales': rng.integers(-50000, 150000, rows).astype(float),
+        'AdditionalDiscount ': rng.integers(0, 30000, rows).astype(float),
+        'AdditionalFreeAcc(-) ': rng.integers(0, 8000, rows).astype(float),
+        'DSAComission(-)': rng.integers(0, 5000, rows).astype(float),
+        'TOTAL DLR SHARE': rng.integers(0, 20000, rows).astype(float),
+        'TOTAL TATA SHARE': rng.integers(0, 25000, rows).astype(float),
+        'Tata DMS Credit': rng.integers(0, 60000, rows).astype(float),
+        'Margin': rng.integers(-80000, 120000, rows).astype(float),
+    })
+    totals = data.drop(columns=['SNO']).select_dtypes(include='number').sum()
+    totals['SNO'] = rows
+    totals['Location'] = f'Total ({rows})'
+    return pd.concat([data, pd.DataFrame([totals])], ignore_index=True)
+
+def _sales_rows(rows, locations, models, returns_rate, rng):
+    # Columns the pipeline reads from the main sales sheet. A returns_rate share of rows
+    # are cancellations: a second row for an earlier chassis with COUNT -1.
+    chassis = np.array([f'MAT{i:014d}' for i in range(rows)], dtype=object)
+    count = np.ones(rows, dtype=int)
+    returns = np.flatnonzero(rng.random(rows) < returns_rate)
+    returns = returns[returns > 0]
+    chassis[returns] = chassis[rng.integers(0, returns)]
+    count[returns] = -1
+    return {
+        'SNO': np.arange(1, rows + 1),
+        'Location': rng.choice([f'LOCATION {i:02d}' for i in range(locations)], rows),
+        'Model': rng.choice([f'MODEL {i:03d}' for i in range(models)], rows),
+        'ChassisNo': chassis,
+        'COUNT': count,
+        'GST%': np.full(rows, 28.0),
+        'CESS%': rng.choice([1.0, 17.0, 20.0, 22.0], rows),
+        'Sale Price(+)': rng.integers(500000, 2500000, rows).astype(float),
+        'Discount-DBT(-)': rng.integers(0, 80000, rows).astype(float),
+        'Purchase Price(-)': rng.integers(400000, 2300000, rows).astype(float),
+        'AdditionalDiscount': rng.integers(0, 30000, rows).astype(float),
+        'AdditionalFreeAcc(-)': rng.integers(0, 8000, rows).astype(float),
+        'DSAComission(-)': rng.integers(0, 5000, rows).astype(float),
+        'Exchange Dlr Share(+)': rng.integers(0, 15000, rows).astype(float),
+        'Corporate Dealer Share(+)': np.zeros(rows),
+        'Exchange Tata Share(+)': rng.integers(0, 15000, rows).astype(float),
+        'Loyalty Mfr Share(+)': rng.integers(0, 10000, rows).astype(float),
+        'Scrap Mfg Share(+)': np.zeros(rows),
+    }
+
+def sales_workbook(path, rows, locations=20, models=60, returns_rate=0.02, seed=0):
+    """Write a main sales workbook with the real layout: 6 preamble rows, then every dropped and used column.
+
+    Returns the chassis numbers of the distinct vehicles sold.
+    """
+    from openpyxl import Workbook
+    from ingest import DROPPED_COLUMNS
+
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame(_sales_rows(rows, locations, models, returns_rate, rng))
+    for i, col in enumerate(DROPPED_COLUMNS):
+        data[col] = rng.integers(0, 100000, rows).astype(float) if i % 2 else f'{col} text'
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('Sales')
+    for line in ['Vehicle Sales Register', 'Dealer: SYNTHETIC', '', '', '', '']:
+        ws.append([line])
+    ws.append(list(data.columns))
+    for values in data.itertuples(index=False, name=None):
+        ws.append(values)
+    wb.save(path)
+    return pd.Series(data['ChassisNo'].unique())
+
+def reco_workbook(path, chassis_numbers, missing_rate=0.0, duplicate_rate=0.0, extra_columns=10, seed=0):
+    """Write a Chassis/PV reconciliation workbook for the given chassis numbers.
+
+    missing_rate leaves that share of chassis out (they show up as unmatched);
+    duplicate_rate repeats that share of rows with a blank or different discount.
+    """
+    from openpyxl import Workbook
+
+    rng = np.random.default_rng(seed)
+    chassis = pd.Series(chassis_numbers)
+    chassis = chassis[rng.random(len(chassis)) >= missing_rate]
+    discounts = rng.integers(0, 90000, len(chassis)).astype(float)
+    duplicates = rng.random(len(chassis)) < duplicate_rate
+    extra_discounts = np.where(rng.random(duplicates.sum()) < 0.5, np.nan, rng.integers(0, 90000, duplicates.sum()))
+    reco = pd.DataFrame({
+        'Chassis_No': np.concatenate([chassis.to_numpy(dtype=object), chassis[duplicates].to_numpy(dtype=object), [None]]),
+        'Total Discount': np.concatenate([discounts, extra_discounts, [0.0]]),
+    }).sample(frac=1, random_state=seed)
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet('PV')
+    ws.append(['Chassis_No', 'Total Discount'] + [f'Reco Field {i}' for i in range(extra_columns)])
+    filler = [f'value {i}' for i in range(extra_columns)]
+    for chassis_no, discount in reco.itertuples(index=False, name=None):
+        ws.append([chassis_no, None if np.isnan(discount) else discount] + filler)
+    wb.save(path)
+
+def generate(out_dir, rows, locations=20, models=60, returns_rate=0.02, missing_rate=0.05,
+             duplicate_rate=0.02, seed=0):
+    """Write sales_<rows>.xlsx and chassis_<rows>.xlsx into out_dir and return their paths"""
+    os.makedirs(out_dir, exist_ok=True)
+    main_path = os.path.join(out_dir, f'sales_{rows}.xlsx')
+    reco_path = os.path.join(out_dir, f'chassis_{rows}.xlsx')
+    chassis = sales_workbook(main_path, rows, locations, models, returns_rate, seed)
+    reco_workbook(reco_path, chassis, missing_rate, duplicate_rate, seed=seed)
+    return main_path, reco_path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate synthetic main sales and Chassis/PV workbooks")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1_000], help="Main sheet sizes, e.g. 1000 100000 500000")
+    parser.add_argument('--locations', type=int, default=20)
+    parser.add_argument('--models', type=int, default=60)
+    parser.add_argument('--returns-rate', type=float, default=0.02, help="Share of main rows that cancel an earlier sale")
+    parser.add_argument('--missing-rate', type=float, default=0.05, help="Share of chassis left out of the reconciliation file")
+    parser.add_argument('--duplicate-rate', type=float, default=0.02, help="Share of reconciliation rows repeated")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out-dir', default='synthetic_data')
+    args = parser.parse_args()
+    for rows in args.rows:
+        paths = generate(args.out_dir, rows, args.locations, args.models, args.returns_rate,
+                         args.missing_rate, args.duplicate_rate, args.seed)
+        print(*paths)
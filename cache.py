@@ -0,0 +1,125 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+def content_key(content):
+    """Cache key for the raw bytes of an uploaded workbook"""
+    return hashlib.sha256(content).hexdigest()
+
+def frame_size(data):
+    return int(data.memory_usage(index=True, deep=True).sum())
+
+class SheetCache:
+    """Parsed workbook sheets keyed by file content hash and sheet name.
+
+    Holds the sheet list of each workbook, the header rows checked on upload and
+    the parsed DataFrames. Frames are
+    evicted least recently used first once they exceed max_bytes; with spill_dir
+    set (and pyarrow installed) evicted frames are kept as Parquet files and read
+    back instead of reparsing the Excel file. Spill files are deleted least recently
+    used first once together they exceed max_spill_bytes.
+    """
+
+    def __init__(self, max_bytes=512 * 2**20, spill_dir=None, max_spill_bytes=2 * 2**30):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.sheet_names = {}
+        self.headers = {}
+        self.frames = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def get_sheet_names(self, key):
+        with self.lock:
+            return self.sheet_names.get(key)
+
+    def put_sheet_names(self, key, sheet_names):
+        with self.lock:
+            self.sheet_names[key] = list(sheet_names)
+
+    def get_header(self, key, sheet_name, skiprows):
+        with self.lock:
+            return self.headers.get((key, sheet_name, skiprows))
+
+    def put_header(self, key, sheet_name, skiprows, header):
+        with self.lock:
+            self.headers[(key, sheet_name, skiprows)] = list(header)
+
+    def get(self, key, sheet_name, kind):
+        """Return a copy of the cached frame, or None when it was never parsed"""
+        entry = (key, sheet_name, kind)
+        with self.lock:
+            if entry in self.frames:
+                self.frames.move_to_end(entry)
+                return self.frames[entry][0].copy()
+        data = self._read_spill(entry)
+        if data is not None:
+            self.put(key, sheet_name, kind, data)
+            return data.copy()
+        return None
+
+    def put(self, key, sheet_name, kind, data):
+        entry = (key, sheet_name, kind)
+        size = frame_size(data)
+        with self.lock:
+            if entry in self.frames:
+                self.total_bytes -= self.frames.pop(entry)[1]
+            self.frames[entry] = (data.copy(), size)
+            self.total_bytes += size
+            evicted = []
+            while self.total_bytes > self.max_bytes and len(self.frames) > 1:
+                old_entry, (old_data, old_size) = self.frames.popitem(last=False)
+                self.total_bytes -= old_size
+                evicted.append((old_entry, old_data))
+        for old_entry, old_data in evicted:
+            self._write_spill(old_entry, old_data)
+
+    def _spill_path(self, entry):
+        name = hashlib.sha256(repr(entry).encode()).hexdigest()
+        return os.path.join(self.spill_dir, f'{name}.parquet')
+
+    def _write_spill(self, entry, data):
+        if not self.spill_dir:
+            return
+        try:
+            data.to_parquet(self._spill_path(entry))
+        except (ImportError, ValueError, TypeError):
+            # pyarrow missing or a column Parquet cannot store; the sheet is simply reparsed
+            return
+        self._prune_spill()
+
+    def _prune_spill(self):
+        # Delete the least recently used spill files until the rest fit in max_spill_bytes
+        files = []
+        for name in os.listdir(self.spill_dir):
+            path = os.path.join(self.spill_dir, name)
+            try:
+                files.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError:
+                pass
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_spill_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def _read_spill(self, entry):
+        if not self.spill_dir or not os.path.exists(self._spill_path(entry)):
+            return None
+        try:
+            import pandas as pd
+
+            data = pd.read_parquet(self._spill_path(entry))
+            # Mark the file as recently used for _prune_spill()
+            os.utime(self._spill_path(entry))
+            return data
+        except (ImportError, ValueError, OSError):
+            return None
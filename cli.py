@@ -0,0 +1,328 @@
+"""Headless batch mode: run the analysis for many dealer files without the Streamlit app.
+
+Jobs come from a CSV manifest with columns main_file, main_sheet, reco_file, reco_sheet
+and optional name, dealer and period columns, or from a glob of main files that share one Chassis/PV file:
+
+    python cli.py --manifest jobs.csv --output-dir out --workers 4
+    python cli.py --main "2024-*/sales.xlsx" --reco chassis.xlsx --reco-sheet PV --output-dir out
+
+Each job writes <name>_chassis.xlsx and <name>_trim_chassis.xlsx, plus
+<name>_unmatched.csv listing rows whose chassis number is not in the reconciliation
+data, and <name>_reconciliation.json with the Difference sheet checks per location.
+Jobs whose differences exceed --tolerance are flagged in the summary. Empty sheet
+fields mean the first sheet of the workbook.
+
+--profile-json writes per-stage timings, peak memory and row counts of every job
+to one JSON file, and --cprofile-dir saves a cProfile dump per job.
+
+With --reco-index chassis.sqlite every reconciliation sheet of the batch is first
+merged into a persistent chassis index, and all jobs look discounts up there.
+
+--chunk-rows N processes main sheets N rows at a time, keeping memory bounded for
+exports too large to load at once; the workbooks come out the same.
+
+Column widths are fitted to every cell of the detail sheet. For very large sheets,
+--width-sample-rows N measures N evenly spaced rows instead (N per chunk with
+--chunk-rows), and --max-column-width caps the widths.
+
+--export csv parquet also writes the chassis rows and the Location x Model summary as
+<name>_chassis.<format> and <name>_summary.<format>. With --history sales.sqlite the
+Location x Model sums of every job are stored by dealer (default: the job name) and
+period (the manifest's period column or --period, e.g. 2024-03) for later queries.
+
+--trend DEALER compares months stored in --history without reprocessing them, writing
+<dealer>_trend.xlsx with QTY, Net Margin and Per Car Margin per month and their changes:
+
+    python cli.py --trend w_main --history sales.sqlite --periods 2024-01 2024-02 --output-dir out
+"""
+import argparse
+import csv
+import datetime
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+
+from ingest import missing_main_columns, missing_reco_columns, read_main_sheet, read_reco_sheet
+from aggregate import RECONCILIATION_TOLERANCE, reconcile
+from export import EXPORT_FORMATS, TableWriter, chassis_rows, summary_table, write_table
+from history import HistoryStore, normalize_period
+from pipeline import chassis_aggregates, process_data, write_reports
+from profiling import StageProfiler
+from reco_index import ChassisIndex
+from streaming import process_chunked
+from trend import write_trend
+
+MANIFEST_COLUMNS = ['main_file', 'main_sheet', 'reco_file', 'reco_sheet']
+
+def job_name(main_file):
+    # Files from different month folders often share a file name, so include the folder
+    parent = os.path.basename(os.path.dirname(os.path.abspath(main_file)))
+    stem = os.path.splitext(os.path.basename(main_file))[0]
+    return f'{parent}_{stem}' if parent else stem
+
+def read_manifest(path):
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        missing = [col for col in MANIFEST_COLUMNS if col not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Manifest {path} is missing columns: {', '.join(missing)}")
+        jobs = []
+        for row in reader:
+            jobs.append({
+                'name': (row.get('name') or '').strip() or job_name(row['main_file']),
+                'main_file': row['main_file'].strip(),
+                'main_sheet': row['main_sheet'].strip() or None,
+                'reco_file': row['reco_file'].strip(),
+                'reco_sheet': row['reco_sheet'].strip() or None,
+                'dealer': (row.get('dealer') or '').strip() or None,
+                'period': (row.get('period') or '').strip() or None,
+            })
+    return jobs
+
+def glob_jobs(main_pattern, reco_file, main_sheet=None, reco_sheet=None):
+    return [
+        {'name': job_name(path), 'main_file': path, 'main_sheet': main_sheet,
+         'reco_file': reco_file, 'reco_sheet': reco_sheet}
+        for path in sorted(glob.glob(main_pattern))
+    ]
+
+def run_job(job, output_dir, profile=False, cprofile_dir=None):
+    """Process one job; never raises so a bad file does not stop the batch"""
+    if profile or cprofile_dir:
+        profiler = StageProfiler(cprofile=bool(cprofile_dir))
+        with profiler.activate():
+            result = run_job(job, output_dir)
+        result['profile'] = profiler.to_dict()
+        if cprofile_dir:
+            profiler.dump_cprofile(os.path.join(cprofile_dir, f"{job['name']}.prof"))
+        return result
+
+    start = time.perf_counter()
+    result = {'name': job['name'], 'main_file': job['main_file'], 'status': 'ok', 'error': ''}
+    try:
+        check_columns(job)
+        if job.get('reco_index'):
+            sales_reco_data = ChassisIndex.open(job['reco_index'])
+        else:
+            sales_reco_data = read_reco_sheet(job['reco_file'], job['reco_sheet'] or 0)
+        output_file = os.path.join(output_dir, f"{job['name']}_chassis.xlsx")
+        trim_file = os.path.join(output_dir, f"{job['name']}_trim_chassis.xlsx")
+        exports = job.get('export') or []
+        with ExitStack() as stack:
+            chassis_writers = [stack.enter_context(TableWriter(export_file(output_dir, job, 'chassis', fmt), fmt))
+                               for fmt in exports]
+            if job.get('chunk_rows'):
+                result['rows'], unmatched, aggregates = process_chunked(
+                    job['main_file'], job['main_sheet'] or 0, sales_reco_data, output_file, trim_file,
+                    job['chunk_rows'], table_writers=chassis_writers,
+                    width_sample_rows=job.get('width_sample_rows'), max_column_width=job.get('max_column_width'))
+            else:
+                data, unmatched = process_data(read_main_sheet(job['main_file'], job['main_sheet'] or 0),
+                                               sales_reco_data)
+                aggregates = chassis_aggregates(data)
+                write_reports(data, output_file, trim_file, aggregates,
+                              job.get('width_sample_rows'), job.get('max_column_width'))
+                for writer in chassis_writers:
+                    writer.write(chassis_rows(data))
+                result['rows'] = len(data) - 1
+        result['unmatched'] = len(unmatched)
+        result['outputs'] = [output_file, trim_file]
+        for fmt in exports:
+            summary_file = export_file(output_dir, job, 'summary', fmt)
+            write_table(summary_table(aggregates), summary_file, fmt)
+            result['outputs'] += [export_file(output_dir, job, 'chassis', fmt), summary_file]
+        if job.get('history'):
+            HistoryStore(job['history']).append(job.get('dealer') or job['name'], job['period'], aggregates,
+                                                len(unmatched), job['main_file'])
+        reconciliation = reconcile(aggregates, job.get('tolerance', RECONCILIATION_TOLERANCE))
+        result['reconciled'] = reconciliation['ok']
+        result['mismatched_locations'] = reconciliation['mismatched_locations']
+        reconciliation_file = os.path.join(output_dir, f"{job['name']}_reconciliation.json")
+        with open(reconciliation_file, 'w') as f:
+            json.dump(reconciliation, f, indent=2)
+        result['outputs'].append(reconciliation_file)
+        if len(unmatched):
+            unmatched_file = os.path.join(output_dir, f"{job['name']}_unmatched.csv")
+            unmatched.to_csv(unmatched_file, index=False)
+            result['outputs'].append(unmatched_file)
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f'{type(e).__name__}: {e}'
+        result['traceback'] = traceback.format_exc()
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+def check_columns(job):
+    """Fail a job whose sheets lack required columns from their header rows, before they are parsed"""
+    problems = []
+    missing = missing_main_columns(job['main_file'], job['main_sheet'] or 0)
+    if missing:
+        problems.append(f"{job['main_file']} has no column {', '.join(missing)}")
+    if not job.get('reco_index'):
+        missing = missing_reco_columns(job['reco_file'], job['reco_sheet'] or 0)
+        if missing:
+            problems.append(f"{job['reco_file']} has no column {', '.join(missing)}")
+    if problems:
+        raise ValueError('; '.join(problems))
+
+def export_file(output_dir, job, table, fmt):
+    return os.path.join(output_dir, f"{job['name']}_{table}.{fmt}")
+
+def update_reco_index(jobs, path):
+    """Merge every distinct reconciliation sheet of the batch into the index at path"""
+    index = ChassisIndex.open(path)
+    seen = set()
+    for job in jobs:
+        source = (job['reco_file'], job['reco_sheet'])
+        if source in seen:
+            continue
+        seen.add(source)
+        changed = index.update(read_reco_sheet(job['reco_file'], job['reco_sheet'] or 0))
+        print(f"{job['reco_file']}: {changed} chassis added or changed, {len(index)} in index")
+    for job in jobs:
+        job['reco_index'] = path
+
+def run_batch(jobs, output_dir, workers=None, profile=False, cprofile_dir=None):
+    os.makedirs(output_dir, exist_ok=True)
+    if cprofile_dir:
+        os.makedirs(cprofile_dir, exist_ok=True)
+    if workers == 1:
+        return [run_job(job, output_dir, profile, cprofile_dir) for job in jobs]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_job, job, output_dir, profile, cprofile_dir) for job in jobs]
+        for future in as_completed(futures):
+            results.append(future.result())
+    order = {job['name']: i for i, job in enumerate(jobs)}
+    return sorted(results, key=lambda r: order[r['name']])
+
+def print_summary(results, total_seconds, out=sys.stdout):
+    width = max([len(r['name']) for r in results] + [4])
+    print(f"{'job':<{width}}  {'status':<6}  {'rows':>7}  {'unmatched':>9}  {'reconciled':<10}  {'seconds':>8}  error",
+          file=out)
+    for r in results:
+        reconciled = {True: 'yes', False: 'NO', None: ''}[r.get('reconciled')]
+        print(f"{r['name']:<{width}}  {r['status']:<6}  {r.get('rows', ''):>7}  {r.get('unmatched', ''):>9}  "
+              f"{reconciled:<10}  {r['seconds']:>8.2f}  {r['error']}", file=out)
+    failed = sum(r['status'] != 'ok' for r in results)
+    mismatched = sum(r.get('reconciled') is False for r in results)
+    print(f"\n{len(results)} jobs, {failed} failed, {mismatched} not reconciled, {total_seconds:.1f}s wall time", file=out)
+
+def write_profile(path, results, workers, total_seconds):
+    report = {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'workers': workers,
+        'total_seconds': round(total_seconds, 3),
+        'jobs': [{key: value for key, value in r.items() if key != 'traceback'} for r in results],
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+def run_trend(parser, args):
+    if not args.history:
+        parser.error("--trend needs --history")
+    if not os.path.exists(args.history):
+        parser.error(f"History store {args.history} does not exist")
+    os.makedirs(args.output_dir, exist_ok=True)
+    path = os.path.join(args.output_dir, f'{args.trend}_trend.xlsx')
+    start = time.perf_counter()
+    try:
+        periods = write_trend(HistoryStore(args.history), args.trend, path, args.periods)
+    except ValueError as e:
+        print(f"{args.trend}: {e}", file=sys.stderr)
+        return 1
+    missing = sorted(set(map(normalize_period, args.periods or [])) - set(periods))
+    print(f"{path}: {len(periods)} months ({periods[0]} to {periods[-1]}) in {time.perf_counter() - start:.1f}s")
+    if missing:
+        print(f"Not in the history store: {', '.join(missing)}", file=sys.stderr)
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Batch-process vehicle sales files into chassis analysis workbooks")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--manifest', help="CSV with main_file, main_sheet, reco_file, reco_sheet[, name] columns")
+    source.add_argument('--main', help="Glob of main sales files, all reconciled against --reco")
+    source.add_argument('--trend', metavar='DEALER', help="Write the trend workbook of DEALER's months in --history")
+    parser.add_argument('--reco', help="Chassis/PV reconciliation file used with --main")
+    parser.add_argument('--main-sheet', help="Sheet of the main files (default: first sheet)")
+    parser.add_argument('--reco-sheet', help="Sheet of the reconciliation file (default: first sheet)")
+    parser.add_argument('--reco-index', help="SQLite chassis index to merge the reconciliation sheets into and look discounts up from")
+    parser.add_argument('--chunk-rows', type=int, help="Process main sheets this many rows at a time to bound memory")
+    parser.add_argument('--width-sample-rows', type=int,
+                        help="Fit column widths to this many evenly spaced rows instead of every row")
+    parser.add_argument('--max-column-width', type=int, help="Widest a workbook column is made, in characters")
+    parser.add_argument('--tolerance', type=float, default=RECONCILIATION_TOLERANCE,
+                        help="Largest per-location reconciliation difference that still counts as reconciled")
+    parser.add_argument('--export', nargs='+', choices=EXPORT_FORMATS, default=[],
+                        help="Also write the chassis rows and the Location x Model summary in these formats")
+    parser.add_argument('--history', help="SQLite history store to add the Location x Model sums of every job to")
+    parser.add_argument('--period', help="Month of the jobs in the history store, e.g. 2024-03 (manifest: period column)")
+    parser.add_argument('--periods', nargs='+', help="Months compared by --trend (default: every stored month)")
+    parser.add_argument('--output-dir', default='output', help="Directory for the generated workbooks")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Parallel worker processes")
+    parser.add_argument('--profile-json', help="Write per-stage timing and memory of every job to this JSON file")
+    parser.add_argument('--cprofile-dir', help="Save a cProfile dump per job in this directory")
+    parser.add_argument('--verbose', action='store_true', help="Print tracebacks of failed jobs")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.trend:
+        return run_trend(parser, args)
+    if args.manifest:
+        jobs = read_manifest(args.manifest)
+    else:
+        if not args.reco:
+            parser.error("--main needs --reco")
+        jobs = glob_jobs(args.main, args.reco, args.main_sheet, args.reco_sheet)
+    if not jobs:
+        parser.error("No jobs to run")
+    names = [job['name'] for job in jobs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        parser.error(f"Duplicate job names would overwrite each other's output: {', '.join(duplicates)}")
+
+    for job in jobs:
+        job['tolerance'] = args.tolerance
+        job['export'] = args.export
+        if args.chunk_rows:
+            job['chunk_rows'] = args.chunk_rows
+        if args.width_sample_rows:
+            job['width_sample_rows'] = args.width_sample_rows
+        if args.max_column_width:
+            job['max_column_width'] = args.max_column_width
+        if args.history:
+            period = job.get('period') or args.period
+            if not period:
+                parser.error(f"--history needs a period for job {job['name']}: pass --period or add a period column")
+            try:
+                job['period'] = normalize_period(period)
+            except ValueError:
+                parser.error(f"Period {period!r} of job {job['name']} is not a month, e.g. 2024-03")
+            job['history'] = args.history
+    if args.history:
+        # Create the store once, before the workers start adding to it
+        HistoryStore(args.history)
+
+    start = time.perf_counter()
+    if args.reco_index:
+        update_reco_index(jobs, args.reco_index)
+    results = run_batch(jobs, args.output_dir, args.workers, bool(args.profile_json), args.cprofile_dir)
+    total_seconds = time.perf_counter() - start
+    print_summary(results, total_seconds)
+    if args.profile_json:
+        write_profile(args.profile_json, results, args.workers, total_seconds)
+    if args.verbose:
+        for r in results:
+            if r['status'] != 'ok':
+                print(f"\n--- {r['name']} ---\n{r['traceback']}", file=sys.stderr)
+    return 1 if any(r['status'] != 'ok' for r in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
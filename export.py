@@ -0,0 +1,141 @@
+import io
+import os
+
+import pandas as pd
+
+from pipeline import pyarrow_available
+
+# Formats the chassis data and the Location x Model summary can be exported to
+EXPORT_FORMATS = ['csv', 'parquet']
+
+def value_kinds(frame):
+    """{column: kind of its values}: 'bool', 'datetime', 'number', 'text' or 'blank' without any value"""
+    kinds = {}
+    for col, dtype in frame.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            kinds[col] = 'bool'
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            kinds[col] = 'datetime'
+        elif not frame[col].notna().any():
+            kinds[col] = 'blank'
+        elif pd.api.types.is_numeric_dtype(dtype):
+            kinds[col] = 'number'
+        else:
+            kinds[col] = 'text'
+    return kinds
+
+def columnar_dtypes(kinds):
+    """dtype of every column of an exported table from the set of value_kinds() of its rows.
+
+    Numbers are written as float64 and text as nullable strings, so a column has the
+    same type in every month's export whether or not it has blanks; dates keep their
+    type. A column whose rows hold more than one kind, or no values at all, is written
+    as text, like pandas reads such a column in one piece. Flags are written as
+    booleans unless the column also has blanks. The kinds of chunks written one at a
+    time are merged per column so the table gets the types of the whole of it.
+    """
+    dtypes = {}
+    for col, col_kinds in kinds.items():
+        values = col_kinds - {'blank'}
+        if col_kinds == {'bool'}:
+            dtypes[col] = 'boolean'
+        elif values == {'datetime'}:
+            dtypes[col] = 'datetime64[ns]'
+        elif values == {'number'}:
+            dtypes[col] = 'float64'
+        else:
+            dtypes[col] = 'string'
+    return dtypes
+
+def frame_dtypes(frame):
+    # columnar_dtypes() of a table written in one piece
+    return columnar_dtypes({col: {kind} for col, kind in value_kinds(frame).items()})
+
+def as_dtypes(frame, dtypes):
+    """frame converted to columnar_dtypes().
+
+    Numbers in a text column are written the way pandas reads them from a mixed
+    column, whole numbers without a decimal point.
+    """
+    mixed = [col for col, dtype in dtypes.items() if dtype == 'string' and pd.api.types.is_float_dtype(frame[col])]
+    if mixed:
+        frame = frame.copy()
+        for col in mixed:
+            values = [int(value) if value % 1 == 0 else value for value in frame[col]]
+            frame[col] = pd.Series(values, index=frame.index, dtype=object)
+    return frame.astype(dtypes)
+
+class TableWriter:
+    """Writes one table as CSV or Parquet to a path or binary file object, a chunk at a time.
+
+    Every chunk is converted to the same columnar_dtypes(), so the chunks of
+    process_chunked() end up in one file with one schema.
+    """
+
+    def __init__(self, target, fmt):
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}, expected one of: {', '.join(EXPORT_FORMATS)}")
+        if fmt == 'parquet' and not pyarrow_available():
+            raise ImportError("Parquet export needs pyarrow: pip install pyarrow")
+        self.target = target
+        self.fmt = fmt
+        self.dtypes = None
+        self.handle = None
+        self.parquet = None
+
+    def write(self, frame, dtypes=None):
+        """Append frame to the table.
+
+        dtypes are the columnar_dtypes() of the whole table, needed when it is written
+        in chunks; by default the table gets those of the first chunk.
+        """
+        header = self.dtypes is None
+        if header:
+            self.dtypes = dtypes or frame_dtypes(frame)
+            self.handle = open(self.target, 'wb') if isinstance(self.target, (str, os.PathLike)) else self.target
+        frame = as_dtypes(frame, self.dtypes).rename(columns=str)
+        if self.fmt == 'csv':
+            self.handle.write(frame.to_csv(index=False, header=header).encode())
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        if self.parquet is None:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            self.parquet = pq.ParquetWriter(self.handle, table.schema)
+        else:
+            table = pa.Table.from_pandas(frame, schema=self.parquet.schema, preserve_index=False)
+        self.parquet.write_table(table)
+
+    def close(self):
+        if self.parquet is not None:
+            self.parquet.close()
+        if self.handle is not None and self.handle is not self.target:
+            self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def write_table(frame, target, fmt):
+    with TableWriter(target, fmt) as writer:
+        writer.write(frame)
+
+def chassis_rows(data):
+    # The processed chassis data without the totals row added by total_row()
+    return data.iloc[:len(data)-1]
+
+def summary_table(aggregates):
+    """The Summary sheet as one flat table: a row per (Location, Model) with its measures and Per Car Margin"""
+    table = aggregates.location_model().reset_index()
+    table['Per Car Margin'] = round(table['Net Margin'] / table['QTY'], 0)
+    return table
+
+def table_bytes(data, aggregates, fmt):
+    """Chassis rows and Location x Model summary of one run, each as a file's bytes in fmt"""
+    chassis = io.BytesIO()
+    write_table(chassis_rows(data), chassis, fmt)
+    summary = io.BytesIO()
+    write_table(summary_table(aggregates), summary, fmt)
+    return chassis.getvalue(), summary.getvalue()
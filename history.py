@@ -0,0 +1,100 @@
+import datetime
+import sqlite3
+
+import pandas as pd
+
+from aggregate import AGGREGATED_COLUMNS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    dealer TEXT NOT NULL,
+    period TEXT NOT NULL,
+    rows INTEGER,
+    unmatched INTEGER,
+    source TEXT,
+    created TEXT,
+    PRIMARY KEY (dealer, period)
+);
+CREATE TABLE IF NOT EXISTS location_model (
+    dealer TEXT NOT NULL,
+    period TEXT NOT NULL,
+    location TEXT,
+    model TEXT,
+    measure TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS location_model_run ON location_model (dealer, period);
+CREATE INDEX IF NOT EXISTS location_model_measure ON location_model (dealer, measure, period);
+"""
+
+# Seconds a batch worker waits for another one to finish writing the store
+LOCK_TIMEOUT = 30
+
+def normalize_period(period):
+    """'YYYY-MM' for anything pandas reads as a month, e.g. '2024-03', 'Mar 2024' or a date"""
+    return str(pd.Period(period, freq='M'))
+
+def _key(value):
+    return None if pd.isna(value) else str(value)
+
+class HistoryStore:
+    """The Location x Model sums of every processed run, kept in a SQLite file by dealer and month.
+
+    Sums of every AGGREGATED_COLUMNS measure are stored in long form, one row per
+    (dealer, period, location, model, measure), next to a runs table with the row
+    counts of each run. Appending a dealer's month again replaces what was stored for
+    it, so reprocessing a month never counts it twice. Month-over-month questions are
+    then one query instead of a rerun of the archived workbooks:
+
+        SELECT period, SUM(value) FROM location_model
+        WHERE dealer = ? AND measure = 'Margin' GROUP BY period ORDER BY period
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=LOCK_TIMEOUT)
+
+    def append(self, dealer, period, aggregates, unmatched=0, source=''):
+        """Store the ChassisAggregates of one run as dealer's sums for period"""
+        period = normalize_period(period)
+        groups = aggregates.groups.reset_index()
+        values = groups.melt(id_vars=['Location', 'Model'], value_vars=AGGREGATED_COLUMNS,
+                             var_name='measure', value_name='value')
+        rows = [(dealer, period, _key(location), _key(model), measure, None if pd.isna(value) else float(value))
+                for location, model, measure, value in values.itertuples(index=False)]
+        created = datetime.datetime.now().isoformat(timespec='seconds')
+        with self._connect() as conn:
+            conn.execute('DELETE FROM location_model WHERE dealer = ? AND period = ?', (dealer, period))
+            conn.execute('INSERT OR REPLACE INTO runs (dealer, period, rows, unmatched, source, created) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', (dealer, period, aggregates.rows, unmatched, source, created))
+            conn.executemany('INSERT INTO location_model (dealer, period, location, model, measure, value) '
+                             'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def runs(self, dealer=None):
+        """Stored runs, oldest period first"""
+        if dealer is None:
+            return self.query('SELECT * FROM runs ORDER BY dealer, period')
+        return self.query('SELECT * FROM runs WHERE dealer = ? ORDER BY period', (dealer,))
+
+    def sums(self, dealer, measures, periods=None):
+        """Stored sums of measures for dealer, as period, location, model, measure, value rows.
+
+        periods limits the result to those months; by default every stored month is read.
+        """
+        sql = (f"SELECT period, location, model, measure, value FROM location_model "
+               f"WHERE dealer = ? AND measure IN ({', '.join('?' * len(measures))})")
+        params = [dealer] + list(measures)
+        if periods is not None:
+            periods = [normalize_period(period) for period in periods]
+            sql += f" AND period IN ({', '.join('?' * len(periods))})"
+            params += periods
+        return self.query(sql, params)
+
+    def query(self, sql, params=()):
+        """Result of a SQL query on the store as a DataFrame"""
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
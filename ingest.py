@@ -0,0 +1,241 @@
+import posixpath
+import zipfile
+from xml.etree import ElementTree
+
+from profiling import profiled
+
+# pandas and openpyxl are imported by the functions that read sheets, so listing sheets
+# and checking header rows loads neither
+
+# Columns of the main sales sheet that the analysis never uses
+DROPPED_COLUMNS = ['Address','City','Locality','PinCode','Customer PhoneNo','Mobile No','Color Code','Color','Source',
+                   'Manuf. Discount(-)','GatePass No.','GatePass Date','Registration Amount-RDTAX(+)',
+                   'Insurance Amount-INSU(+)','Logistics Charges-HANDL(+)','Extended Warranty-EXTWAR(+)',
+                   'Accessories Amount-ACCA','HSRP Charges-HSRP(+)','FASTAG Charges-FASTAG(+)','AMC Charges-AMC(+)',
+                   'Other Charges-OTHCHG(+)','DISCOUNT ON INSURANC-DAT(-)','OP_SGST_RTO-OPSGSTRTO1(+)',
+                   'OP_CGSTEV_RTO-OPCGSTEVRT1(+)','RTO CHARGES-RTO(+)','RDTAX (Paid)(-)','INSU (Paid)(-)','HANDL (Paid)(-)',
+                   'EXTWAR (Paid)(-)','HSRP (Paid)(-)','FASTAG (Paid)(-)','AMC (Paid)(-)','OTHCHG (Paid)(-)',
+                   'OP_SGST_RTO (Paid)(-)','OP_CGSTEV_RT (Paid)(-)','RTO (Paid)(-)','ACC_Paid(-)','Consumer Offer(Cash)',
+                   'Consumer Offer(Acc)(-)','CorpDisc_Dealer','CorpDisc_Mfr(+)','Voucher Credit(+)','Voucher Debit(-)',
+                   'InterestAmt(-)','Accessories Free Scheme Dlr Share','Accessories Free Scheme Mfr Share',
+                   'Discounts on Insurance','EW Free Scheme Dlr Share','EW Free Scheme Mfr Share','Actual Acc. Amount Used(+)',
+                   'Supplement Purchase Invoice No','Supplement Purchase Invoice Amount(-)','Debit Note No',
+                   'Debit Note Amount(+)','Profit','Profit With Interest','DSA Adjustment']
+
+# The only columns the pipeline needs from the Chassis/PV reconciliation sheet
+RECO_COLUMNS = ['Chassis_No', 'Total Discount']
+
+# SpreadsheetML namespaces of the workbook parts read by read_header()
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+# Rows above the header in the main sales sheet
+MAIN_SHEET_SKIPROWS = 6
+
+# Columns of the main sales sheet the analysis reads; processing a sheet without them fails
+REQUIRED_MAIN_COLUMNS = ['Location', 'Model', 'ChassisNo', 'COUNT', 'GST%', 'CESS%', 'Sale Price(+)',
+                         'Purchase Price(-)', 'Discount-DBT(-)', 'AdditionalDiscount', 'AdditionalFreeAcc(-)',
+                         'DSAComission(-)']
+
+def calamine_available():
+    """True when pandas can read Excel through the python-calamine engine"""
+    try:
+        import python_calamine  # noqa: F401
+        from pandas.io.excel import _calamine  # noqa: F401  (pandas >= 2.2)
+    except ImportError:
+        return False
+    return True
+
+def excel_engine():
+    """Fastest installed Excel reader engine"""
+    return 'calamine' if calamine_available() else 'openpyxl'
+
+@profiled('read_main_sheet')
+def read_main_sheet(source, sheet_name, engine=None):
+    """Read the main sales sheet without the columns listed in DROPPED_COLUMNS"""
+    import pandas as pd
+
+    dropped = set(DROPPED_COLUMNS)
+    return pd.read_excel(source, sheet_name=sheet_name, skiprows=MAIN_SHEET_SKIPROWS,
+                         usecols=lambda col: col not in dropped, engine=engine or excel_engine())
+
+@profiled('read_reco_sheet')
+def read_reco_sheet(source, sheet_name, engine=None):
+    """Read only the chassis number and discount columns of the reconciliation sheet"""
+    import pandas as pd
+
+    return pd.read_excel(source, sheet_name=sheet_name, usecols=RECO_COLUMNS, engine=engine or excel_engine())
+
+def _excel_value(value):
+    # Cell value as pandas' openpyxl reader passes it on: blanks are '' and whole floats are ints
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def iter_main_sheet(source, sheet_name, chunk_rows=50_000):
+    """Read the main sales sheet as DataFrames of up to chunk_rows rows, without DROPPED_COLUMNS.
+
+    Rows are streamed from the workbook with openpyxl's read-only mode, so only one
+    chunk is in memory at a time. Each chunk is parsed like read_main_sheet() parses
+    the whole sheet, and keeps its row positions in the sheet as its index.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = _sheet_rows(wb, sheet_name)
+        header = _header_row(rows, MAIN_SHEET_SKIPROWS)
+        dropped = set(DROPPED_COLUMNS)
+        keep = [j for j, col in enumerate(header) if col not in dropped]
+        header = [_excel_value(header[j]) for j in keep]
+        start = 0
+        block = []
+        for row in rows:
+            block.append(row)
+            if len(block) == chunk_rows:
+                yield _parse_rows(header, block, keep, start)
+                start += len(block)
+                block = []
+        if block or not start:
+            yield _parse_rows(header, block, keep, start)
+    finally:
+        wb.close()
+
+def _sheet_rows(wb, sheet_name):
+    # Row values of a sheet given by name or position, from a read-only workbook
+    ws = wb[sheet_name] if isinstance(sheet_name, str) else wb.worksheets[sheet_name]
+    ws.reset_dimensions()
+    return ws.iter_rows(values_only=True)
+
+def _header_row(rows, skiprows):
+    # The row after skiprows rows, without its trailing empty cells
+    for _ in range(skiprows):
+        next(rows, None)
+    header = list(next(rows, None) or [])
+    while header and header[-1] is None:
+        header.pop()
+    return header
+
+def _parse_rows(header, rows, keep, start):
+    import pandas as pd
+    from pandas.io.parsers import TextParser
+
+    # Blank rows are skipped by the parser, as in read_excel
+    values = [header] + [[_excel_value(row[j]) if j < len(row) else '' for j in keep] for row in rows]
+    data = TextParser(values, header=0).read()
+    data.index = pd.RangeIndex(start, start + len(data))
+    return data
+
+def _part_path(target):
+    # Zip path of a part referenced from xl/workbook.xml
+    return target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+
+def _workbook_parts(archive):
+    # {sheet name: worksheet path} in workbook order, and the shared strings path if any
+    workbook = ElementTree.fromstring(archive.read('xl/workbook.xml'))
+    rels = {rel.get('Id'): rel for rel in ElementTree.fromstring(archive.read('xl/_rels/workbook.xml.rels'))}
+    sheets = {sheet.get('name'): _part_path(rels[sheet.get(f'{_REL_NS}id')].get('Target'))
+              for sheet in workbook.iter(f'{_MAIN_NS}sheet')}
+    strings = [_part_path(rel.get('Target')) for rel in rels.values() if rel.get('Type', '').endswith('/sharedStrings')]
+    return sheets, strings[0] if strings else None
+
+def _shared_strings(archive, path, needed):
+    # {index: text} of the shared strings in needed, parsing the table only up to the last of them
+    strings = {}
+    if not needed or path is None:
+        return strings
+    with archive.open(path) as f:
+        index = 0
+        for _event, element in ElementTree.iterparse(f):
+            if element.tag != f'{_MAIN_NS}si':
+                continue
+            if index in needed:
+                # Plain or rich text; phonetic runs (rPh) are not part of the value
+                runs = element.findall(f'{_MAIN_NS}t') + element.findall(f'{_MAIN_NS}r/{_MAIN_NS}t')
+                strings[index] = ''.join(t.text or '' for t in runs)
+            element.clear()
+            index += 1
+            if index > max(needed):
+                break
+    return strings
+
+def _column_position(ref):
+    # 0-based column of a cell reference such as 'AB7'
+    position = 0
+    for letter in ref.rstrip('0123456789'):
+        position = position * 26 + ord(letter) - ord('A') + 1
+    return position - 1
+
+def _row_cells(archive, path, row_number):
+    # [(column position, cell type, value text)] of one sheet row, parsing the sheet only up to it
+    with archive.open(path) as f:
+        current = 0
+        for _event, element in ElementTree.iterparse(f):
+            if element.tag != f'{_MAIN_NS}row':
+                continue
+            current = int(element.get('r', current + 1))
+            if current > row_number:
+                break
+            if current == row_number:
+                cells = []
+                for position, cell in enumerate(element.iter(f'{_MAIN_NS}c')):
+                    ref = cell.get('r')
+                    column = _column_position(ref) if ref else position
+                    if cell.get('t') == 'inlineStr':
+                        text = ''.join(t.text or '' for t in cell.iter(f'{_MAIN_NS}t'))
+                    else:
+                        text = cell.findtext(f'{_MAIN_NS}v')
+                    cells.append((column, cell.get('t', 'n'), text))
+                return cells
+            element.clear()
+    return []
+
+def sheet_names(source):
+    """Names of the sheets of a workbook, read from its workbook part alone"""
+    with zipfile.ZipFile(source) as archive:
+        return list(_workbook_parts(archive)[0])
+
+def read_header(source, sheet_name, skiprows=0):
+    """Column names in the header row of a sheet, the row read_excel(skiprows=skiprows) uses.
+
+    The worksheet is parsed only up to its header row, and the shared strings only up to
+    the ones the header uses, so this takes milliseconds where reading the sheet takes
+    seconds. openpyxl is not used: its read-only mode scans the whole sheet on load when
+    the file has no dimension record. Names are the cell values, so unlike read_excel
+    repeated names are not numbered and blank cells are ''.
+    """
+    with zipfile.ZipFile(source) as archive:
+        sheets, strings_path = _workbook_parts(archive)
+        path = sheets[sheet_name] if isinstance(sheet_name, str) else list(sheets.values())[sheet_name]
+        cells = _row_cells(archive, path, skiprows + 1)
+        strings = _shared_strings(archive, strings_path, {int(text) for _, kind, text in cells if kind == 's'})
+    header = [None] * (max((column for column, _, _ in cells), default=-1) + 1)
+    for column, kind, text in cells:
+        if text is None:
+            continue
+        if kind == 's':
+            header[column] = strings.get(int(text))
+        elif kind == 'b':
+            header[column] = bool(int(text))
+        elif kind == 'n':
+            header[column] = float(text)
+        else:
+            header[column] = text
+    while header and header[-1] is None:
+        header.pop()
+    return [_excel_value(col) for col in header]
+
+def missing_columns(header, required):
+    """Columns of required that are not in header, in the order of required"""
+    present = set(header)
+    return [col for col in required if col not in present]
+
+def missing_main_columns(source, sheet_name):
+    """REQUIRED_MAIN_COLUMNS not found in the header row of the main sales sheet"""
+    return missing_columns(read_header(source, sheet_name, MAIN_SHEET_SKIPROWS), REQUIRED_MAIN_COLUMNS)
+
+def missing_reco_columns(source, sheet_name):
+    """RECO_COLUMNS not found in the header row of the reconciliation sheet"""
+    return missing_columns(read_header(source, sheet_name), RECO_COLUMNS)
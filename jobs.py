@@ -0,0 +1,129 @@
+import glob
+import os
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import StageProfiler
+
+class Job:
+    """One submitted run: its status, stage progress, result or error"""
+
+    def __init__(self, job_id, label):
+        self.id = job_id
+        self.label = label
+        self.status = 'queued'
+        self.profiler = StageProfiler()
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.outputs = []
+        self.submitted = time.time()
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+
+    def progress(self):
+        """(stage, seconds) for every stage started so far; seconds is None while it runs"""
+        return [(stage['stage'], stage.get('seconds')) for stage in list(self.profiler.stages)]
+
+    def current_stage(self):
+        running = [stage for stage, seconds in self.progress() if seconds is None]
+        return running[-1] if running else None
+
+class JobQueue:
+    """Runs jobs on a bounded thread pool and keeps them in a registry by job ID.
+
+    At most max_workers jobs run at once; later ones wait as 'queued'. Each job runs
+    under its own StageProfiler, so its stages can be polled while it runs. Jobs
+    write their output files to output_dir. Callers forget() a finished job once they
+    have taken its result; jobs left behind are removed with their outputs once they
+    are older than ttl seconds, as are files in output_dir left behind by earlier server
+    processes. Expired jobs are cleaned up on every submit() and get().
+    """
+
+    def __init__(self, max_workers=2, ttl=3600, output_dir=None):
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.output_dir = output_dir or os.path.join(tempfile.gettempdir(), 'vehicle_sales_outputs')
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, func, args=(), label='', outputs=None):
+        """Run func(*args, output_dir=self.output_dir) in the background; returns the job ID.
+
+        outputs(result) lists the files the job wrote, which are deleted with the job.
+        """
+        self.cleanup()
+        job = Job(uuid.uuid4().hex, label)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job, func, args, outputs)
+        return job.id
+
+    def _run(self, job, func, args, outputs):
+        job.status = 'running'
+        try:
+            with job.profiler.activate():
+                job.result = func(*args, output_dir=self.output_dir)
+            job.outputs = list(outputs(job.result)) if outputs else []
+            job.status = 'done'
+        except Exception as e:
+            job.error = f'{type(e).__name__}: {e}'
+            job.traceback = traceback.format_exc()
+            job.status = 'failed'
+        job.finished = time.time()
+
+    def get(self, job_id):
+        self.cleanup()
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def running(self):
+        with self.lock:
+            return sum(job.status == 'running' for job in self.jobs.values())
+
+    def forget(self, job_id, keep_outputs=False):
+        """Drop a job and its result from the registry and delete its output files.
+
+        With keep_outputs the files are left to the caller that took over the result;
+        cleanup() still deletes them once they are older than ttl.
+        """
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+        if job and not keep_outputs:
+            self._remove(job.outputs)
+
+    def cleanup(self):
+        """Forget expired jobs and delete output files older than ttl"""
+        now = time.time()
+        with self.lock:
+            expired = [job for job in self.jobs.values() if job.done and now - job.finished > self.ttl]
+            for job in expired:
+                del self.jobs[job.id]
+            kept = {path for job in self.jobs.values() for path in job.outputs}
+        for job in expired:
+            self._remove(job.outputs)
+        stale = []
+        for path in glob.glob(os.path.join(self.output_dir, '*')):
+            try:
+                if path not in kept and now - os.path.getmtime(path) > self.ttl:
+                    stale.append(path)
+            except OSError:
+                pass
+        self._remove(stale)
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
@@ -1,10 +1,16 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-from openpyxl import load_workbook
 import os
 import tempfile
 import io
+import json
+import time
+import datetime
+# Only modules that load without pandas or openpyxl are imported here, so the page
+# renders and uploads are checked before the pipeline is imported on first use
+from cache import SheetCache, content_key
+from ingest import (MAIN_SHEET_SKIPROWS, RECO_COLUMNS, REQUIRED_MAIN_COLUMNS, missing_columns, read_header,
+                    read_main_sheet, read_reco_sheet, sheet_names)
+from jobs import JobQueue
 
 # Set page config
 st.set_page_config(page_title="Vehicle Sales Analysis", page_icon="🚗", layout="wide")
@@ -13,339 +19,132 @@ st.set_page_config(page_title="Vehicle Sales Analysis", page_icon="🚗", layout
 st.title("🚗 Vehicle Sales Analysis Tool")
 st.markdown("Upload your Excel files to generate comprehensive sales analysis reports")
 
-# Logic of the tool
-def drop_columns(data):
-    drop_columns_list = ['Address','City','Locality','PinCode','Customer PhoneNo','Mobile No','Color Code','Color','Source',
-                         'Manuf. Discount(-)','GatePass No.','GatePass Date','Registration Amount-RDTAX(+)',
-                         'Insurance Amount-INSU(+)','Logistics Charges-HANDL(+)','Extended Warranty-EXTWAR(+)',
-                         'Accessories Amount-ACCA','HSRP Charges-HSRP(+)','FASTAG Charges-FASTAG(+)','AMC Charges-AMC(+)',
-                         'Other Charges-OTHCHG(+)','DISCOUNT ON INSURANC-DAT(-)','OP_SGST_RTO-OPSGSTRTO1(+)',
-                         'OP_CGSTEV_RTO-OPCGSTEVRT1(+)','RTO CHARGES-RTO(+)','RDTAX (Paid)(-)','INSU (Paid)(-)','HANDL (Paid)(-)',
-                         'EXTWAR (Paid)(-)','HSRP (Paid)(-)','FASTAG (Paid)(-)','AMC (Paid)(-)','OTHCHG (Paid)(-)',
-                         'OP_SGST_RTO (Paid)(-)','OP_CGSTEV_RT (Paid)(-)','RTO (Paid)(-)','ACC_Paid(-)','Consumer Offer(Cash)',
-                         'Consumer Offer(Acc)(-)','CorpDisc_Dealer','CorpDisc_Mfr(+)','Voucher Credit(+)','Voucher Debit(-)',
-                         'InterestAmt(-)','Accessories Free Scheme Dlr Share','Accessories Free Scheme Mfr Share',
-                         'Discounts on Insurance','EW Free Scheme Dlr Share','EW Free Scheme Mfr Share','Actual Acc. Amount Used(+)',
-                         'Supplement Purchase Invoice No','Supplement Purchase Invoice Amount(-)','Debit Note No',
-                         'Debit Note Amount(+)','Profit','Profit With Interest','DSA Adjustment']
-    
-    # Only drop columns that exist in the dataframe
-    existing_columns = [col for col in drop_columns_list if col in data.columns]
-    return data.drop(columns=existing_columns, axis=1)
-
-def gst_calculation(data):
-    data['gst'] = data['GST%'] + data['CESS%'] + 100
-    return data
-
-def additional_columns(data):
-    additional_cols = [i for i in data.columns if "Additional" in i]
-    for col in additional_cols:
-        data[col + " "] = round(data[col] * 100 / data['gst'], 0)
-    return data
-
-def dlr_calculation(data):
-    total = 0
-    dlr_cols = [i for i in data.columns if "dlr" in i.lower() or "dealer" in i.lower()]
-    for col in dlr_cols:
-        data[col + " "] = round(data[col] * 100 / data['gst'], 0)
-        total += data[col + " "]
-    data['TOTAL DLR SHARE'] = total
-    return data
-
-def tata_share_calculation(data):
-    total = 0
-    tata_mfr_cols = [i for i in data.columns if "tata" in i.lower() or "mfr" in i.lower() or "mfg" in i.lower() or "manuf(+)" in i.lower()]
-    for col in tata_mfr_cols:
-        data[col + " "] = round(data[col] * 100 / data['gst'], 0)
-        total += data[col + " "]
-    data['TOTAL TATA SHARE'] = total
-    return data
-
-def fetching_discount_chassisno(data, sales_reco_data):
-    # Cleaning sales_reco_data to remove blanks and duplicates
-    clean_sales = sales_reco_data[['Chassis_No', 'Total Discount']].copy()
-    clean_sales = clean_sales.dropna(subset=['Chassis_No'])  # Remove rows with missing Chassis_No
-
-    # Sorting so non-null discounts come first, then drop duplicates
-    clean_sales = (
-        clean_sales.sort_values(by='Total Discount', na_position='last')
-        .drop_duplicates(subset='Chassis_No', keep='first')
-    )
-
-    # Creating a lookup dictionary
-    chassis_to_discount = dict(zip(clean_sales['Chassis_No'], clean_sales['Total Discount']))
-
-    # Filtering `data` to include only rows with matching ChassisNo
-    data_filtered = data[data['ChassisNo'].isin(chassis_to_discount.keys())].copy()
-
-    # Mapping the discount
-    data_filtered['Total Discount'] = data_filtered['ChassisNo'].map(chassis_to_discount)
-    data_filtered['Total Discount'] = data_filtered['Total Discount'] * data_filtered['COUNT']
-
-    return data_filtered
-    
-def purchase_sales(data):
-    data['purchase -sales'] = round(data['Sale Price(+)'] - data['Purchase Price(-)'] - data['Total Discount'])
+# Upper bound on parsed sheets kept in memory across reruns
+SHEET_CACHE_MAX_BYTES = 512 * 2**20
+# Upper bound on the disk used by parsed sheets spilled to SHEET_CACHE_SPILL_DIR
+SHEET_CACHE_SPILL_MAX_BYTES = int(os.environ.get('SHEET_CACHE_SPILL_MAX_BYTES', 2 * 2**30))
+
+# Files processed at the same time by the whole server, and how long results are kept
+MAX_CONCURRENT_JOBS = int(os.environ.get('MAX_CONCURRENT_JOBS', 2))
+JOB_OUTPUT_TTL_SECONDS = int(os.environ.get('JOB_OUTPUT_TTL_SECONDS', 3600))
+# Generated workbooks larger than this are kept in a file instead of in memory
+OUTPUT_SPILL_BYTES = int(os.environ.get('OUTPUT_SPILL_BYTES', 64 * 2**20))
+# How often a session checks on its running job
+JOB_POLL_SECONDS = 1.0
+# SQLite file that keeps the Location x Model sums of runs saved to history
+HISTORY_PATH = os.environ.get('SALES_HISTORY_PATH', 'sales_history.sqlite')
+
+@st.cache_resource
+def job_queue():
+    """Background jobs shared by every session, so the concurrency limit is server-wide"""
+    return JobQueue(max_workers=MAX_CONCURRENT_JOBS, ttl=JOB_OUTPUT_TTL_SECONDS)
+
+@st.cache_resource
+def sheet_cache():
+    """Parsed sheets shared by every session and rerun of this server"""
+    return SheetCache(max_bytes=SHEET_CACHE_MAX_BYTES, spill_dir=os.environ.get('SHEET_CACHE_SPILL_DIR'),
+                      max_spill_bytes=SHEET_CACHE_SPILL_MAX_BYTES)
+
+@st.cache_resource
+def history_store():
+    """The history store of saved runs, opened once per server"""
+    from history import HistoryStore
+
+    return HistoryStore(HISTORY_PATH)
+
+def cached_sheet(content, source, sheet_name, reader):
+    """Parse a sheet once per distinct file content, then serve it from the sheet cache"""
+    key = content_key(content)
+    data = sheet_cache().get(key, sheet_name, reader.__name__)
+    if data is None:
+        data = reader(source, sheet_name)
+        sheet_cache().put(key, sheet_name, reader.__name__, data)
     return data
 
-def margin_calculation(data):
-    data['Margin'] = round(data['purchase -sales'] - data['AdditionalDiscount '] - data['TOTAL DLR SHARE'] - 
-                           data['AdditionalFreeAcc(-) '] - data['DSAComission(-)'])
-    return data
-
-def total_row(data):
-    total = data.loc[:len(data)-1].select_dtypes(include='number')
-    total = total.drop(columns=['SNO'], axis=1, errors='ignore')
-    total = total.sum()
-    total_row = {}
-    for col in data.columns:
-        if col in total.index:
-            total_row[col] = total[col]
-        elif col.lower() == 'sno':
-            total_row[col] = len(data)
-        elif col.lower() == 'location':
-            total_row[col] = f'Total ({len(data)})'
-    total_row_df = pd.DataFrame([total_row], columns=list(total_row.keys()))
-    data = pd.concat([data, total_row_df], ignore_index=True)
-    data = data.rename(columns={'Total Discount': 'Tata DMS Credit'})
-    return data
-
-def chassis_file(data, file_path):
-    data.to_excel(file_path, index=False, engine='openpyxl')
-    wb = load_workbook(file_path)
-    ws = wb.active
-    for column_cells in ws.columns:
-        length = max(len(str(cell.value)) for cell in column_cells)
-        ws.column_dimensions[column_cells[0].column_letter].width = length + 2
-    wb.save(file_path)
-
-def chassis_file_trim(data, file_path):
-    trim_data = data.loc[len(data)-1]
-    new_data = data.copy()
-    drop_column = []
-    for col in data.columns:
-        if trim_data[col] == 0:
-            drop_column.append(col)
-            new_data = new_data.drop(columns=col, axis=1)
-    new_data.to_excel(file_path, index=False, engine='openpyxl')
-    wb = load_workbook(file_path)
-    ws = wb.active
-    for column_cells in ws.columns:
-        length = max(len(str(cell.value)) for cell in column_cells)
-        ws.column_dimensions[column_cells[0].column_letter].width = length + 2
-    wb.save(file_path)
-
-def summary(data, file_path):
-    sheet_name = 'Summary'
-    row_spacing = 2
-    location = data['Location'].unique()
-    location = location[:len(location)-1]
-    location = sorted(location)
-    
-    wb = load_workbook(file_path)
-    if sheet_name in wb.sheetnames:
-        del wb[sheet_name]
-    wb.create_sheet(title=sheet_name)
-    ws = wb[sheet_name]
-    current_row = 1
-    
-    for i in location:
-        show_rm = data[data['Location'] == i]
-        model = show_rm['Model'].unique()
-        model = sorted(model)
-        
-        sr_df1 = pd.DataFrame({
-            'MODEL': model,
-            'QTY':   [show_rm[show_rm['Model'] == m]['COUNT'].sum() for m in model],
-            'SALE-PUR DIFF': [show_rm[show_rm['Model'] == m]['purchase -sales'].sum() for m in model],
-            'Additional Discount': [show_rm[show_rm['Model'] == m]['AdditionalDiscount '].sum() for m in model],
-            'Additional Accessories Discount': [show_rm[show_rm['Model'] == m]['AdditionalFreeAcc(-) '].sum() for m in model],
-            'DSA Commission': [show_rm[show_rm['Model'] == m]['DSAComission(-)'].sum() for m in model],
-            'Dlr share in Retail Support': [show_rm[show_rm['Model'] == m]['TOTAL DLR SHARE'].sum() for m in model],
-            'Net Margin': [show_rm[show_rm['Model'] == m]['Margin'].sum() for m in model]
-        })
-        sr_df1['Per Car Margin'] = round(sr_df1['Net Margin'] / sr_df1['QTY'],0)
-        total_row = round(sr_df1.select_dtypes(include='number').drop(columns='Per Car Margin').sum(),0)
-        total_row['Per Car Margin'] = round(total_row['Net Margin'] / total_row['QTY'],0)
-        total_row['MODEL'] = 'TOTAL'
-        sr_df1.loc[len(sr_df1)] = total_row
-
-        sr_df2 = pd.DataFrame({
-            'TATA RETAIL SUPPORT': [show_rm[show_rm['Model'] == m]['TOTAL TATA SHARE'].sum() for m in model],
-            'MFG share in Retail Support CREDIT IN TATA PUR': [show_rm[show_rm['Model'] == m]['Tata DMS Credit'].sum() for m in model]
-        })
-        total_row_2 = round(sr_df2.select_dtypes(include='number').sum(),0)
-        sr_df2.loc[len(sr_df2)] = total_row_2
-
-        sr_df3 = pd.DataFrame()
-        sr_df3['TOTAL ADDL DISC'] = round(
-            sr_df1['Additional Discount'] +
-            sr_df1['Additional Accessories Discount'] +
-            sr_df1['DSA Commission'],0
-        )
-        sr_df3['ADDIL DISC PER CAR'] = round(sr_df3['TOTAL ADDL DISC'] / sr_df1['QTY'],0)
-
-        with pd.ExcelWriter(file_path, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
-            pd.DataFrame({f'Location: {i}': ['']}).to_excel(writer, sheet_name=sheet_name, startrow=current_row, startcol=0, index=False, header=True)
-            current_row += 2
-
-            sr_df1.to_excel(writer, sheet_name=sheet_name, startrow=current_row, startcol=0, index=False)
-            sr_df2.to_excel(writer, sheet_name=sheet_name, startrow=current_row, startcol=len(sr_df1.columns) + 2, index=False)
-            sr_df3.to_excel(writer, sheet_name=sheet_name, startrow=current_row, startcol=len(sr_df1.columns) + len(sr_df2.columns) + 4, index=False)
-
-            current_row += max(len(sr_df1), len(sr_df2), len(sr_df3)) + row_spacing
-
-    wb = load_workbook(file_path)
-    ws = wb[sheet_name]
-    for column_cells in ws.columns:
-        max_len = max(len(str(cell.value)) if cell.value else 0 for cell in column_cells)
-        ws.column_dimensions[column_cells[0].column_letter].width = max_len + 2
-    wb.save(file_path)
-
-def move_dynamic_total_to_bottom(df, data, group_col="Location"):
-    # Get the last unique value of the group column from the original data
-    total_row_label = data[group_col].dropna().unique()[-1]
-    
-    if total_row_label in df.index:
-        total_row = df.loc[[total_row_label]]
-        df = df.drop(index=total_row_label)
-        df = pd.concat([df, total_row])
-    return df
-
-
-def verify_data(data, file_path):
-    sheet_name = 'Difference'
-    row_spacing = 2
-    
-    wb = load_workbook(file_path)
-    if sheet_name in wb.sheetnames:
-        del wb[sheet_name]
-    wb.create_sheet(title=sheet_name)
-    ws = wb[sheet_name]
-    current_row = 1
-
-    df1 = data[['Location','Sale Price(+)','Discount-DBT(-)','Purchase Price(-)']].groupby('Location').sum().round(0)
-    df1 = move_dynamic_total_to_bottom(df1, data)
-    purchase_price = df1['Purchase Price(-)']
-    df1 = df1.drop(columns=['Purchase Price(-)'],axis=1)
-    df1 = df1.rename(columns={'Sale Price(+)':'Sale','Discount-DBT(-)':'Discount'})
-    df1['Net Sale'] = round(df1['Sale'] - df1['Discount'],0)
-    df1['Purchase'] = purchase_price
-    df1['Profit'] = round(df1['Net Sale'] - df1['Purchase'],0)
-    
-    df2 = data[['AdditionalDiscount ','TOTAL DLR SHARE','TOTAL TATA SHARE']].groupby(data['Location']).sum().round(0)
-    df2 = move_dynamic_total_to_bottom(df2, data)
-    df2['Total Discount'] = round(df2['AdditionalDiscount '] + df2['TOTAL DLR SHARE'] + df2['TOTAL TATA SHARE'],0)
-    df2['Discount-DBT(-)'] = data['Discount-DBT(-)'].groupby(data['Location']).sum().round(0)
-    df2['Difference'] = round(df2['Total Discount'] - df2['Discount-DBT(-)'],0)
-    
-    df3 = data[["TOTAL TATA SHARE","AdditionalFreeAcc(-) ",'DSAComission(-)','Tata DMS Credit']].groupby(data['Location']).sum().round(0)
-    df3['Balance'] = round(df3['TOTAL TATA SHARE'] - df3['AdditionalFreeAcc(-) '] - df3['DSAComission(-)'] - df3['Tata DMS Credit'],0)
-    df3 = move_dynamic_total_to_bottom(df3, data)
-    total = round(df1['Profit'] + df3['Balance'],0)
-    total = total.values
-    total = total[len(total)-1]
-    total_margin = data['Margin'].groupby(data['Location']).sum().round(0)
-    total_margin = move_dynamic_total_to_bottom(total_margin, data)
-    total_margin = total_margin.values
-    total_margin = total_margin[len(total_margin)-1]
-
-    diff = abs(total-total_margin)
-    with pd.ExcelWriter(file_path, engine='openpyxl', mode='a', if_sheet_exists='overlay') as writer:
-        df1.to_excel(writer, sheet_name=sheet_name, startrow=current_row, startcol=0, index=True)
-        current_row += len(df1) + row_spacing
-
-        df2.to_excel(writer, sheet_name=sheet_name, startrow=current_row, startcol=0, index=True)
-        current_row += len(df2) + row_spacing
-
-        df3.to_excel(writer, sheet_name=sheet_name, startrow=current_row, startcol=0, index=True)
-        current_row += len(df3) + row_spacing
-
-        pd.DataFrame({f'Total': [total]}).to_excel(
-            writer, sheet_name=sheet_name, startrow=current_row, startcol=len(df3.columns)-1, index=False, header=True
-        )
-        current_row += 2
-
-        pd.DataFrame({f'Total Margin': [total_margin]}).to_excel(
-            writer, sheet_name=sheet_name, startrow=current_row, startcol=len(df3.columns)-1, index=False, header=True
-        )
-        current_row += 2
-
-        pd.DataFrame({f'Difference': [diff]}).to_excel(
-            writer, sheet_name=sheet_name, startrow=current_row, startcol=len(df3.columns)-1, index=False, header=True
-        )
-
-    wb = load_workbook(file_path)
-    ws = wb[sheet_name]
-    for column_cells in ws.columns:
-        max_len = max(len(str(cell.value)) if cell.value else 0 for cell in column_cells)
-        ws.column_dimensions[column_cells[0].column_letter].width = max_len + 2
-    wb.save(file_path)
-    
 def get_sheet_names(file):
     """Get all sheet names from an Excel file"""
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp:
-        tmp.write(file.read())
-        tmp_path = tmp.name
-    
-    try:
-        excel_file = pd.ExcelFile(tmp_path)
-        sheet_names = excel_file.sheet_names
-        excel_file.close()
-        return sheet_names
-    finally:
-        if os.path.exists(tmp_path):
-            os.unlink(tmp_path)
-
-def process_files(main_file, sales_reco_file, main_sheet_name, sales_sheet_name):
-    # Create temporary files
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_main:
-        tmp_main.write(main_file.read())
-        main_file_path = tmp_main.name
+    content = file.read()
+    key = content_key(content)
+    names = sheet_cache().get_sheet_names(key)
+    if names is not None:
+        return names
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_sales:
-        tmp_sales.write(sales_reco_file.read())
-        sales_file_path = tmp_sales.name
+    names = sheet_names(io.BytesIO(content))
+    sheet_cache().put_sheet_names(key, names)
+    return names
+
+def sheet_header(file, sheet_name, skiprows=0):
+    """Column names in the header row of a sheet, read once per distinct file content"""
+    content = file.getvalue()
+    key = content_key(content)
+    header = sheet_cache().get_header(key, sheet_name, skiprows)
+    if header is None:
+        header = read_header(io.BytesIO(content), sheet_name, skiprows)
+        sheet_cache().put_header(key, sheet_name, skiprows, header)
+    return header
+
+def keep_output(content, output_dir=None, suffix='.xlsx'):
+    """Keep a generated file in memory, or in a file when it is larger than OUTPUT_SPILL_BYTES.
+
+    Returns the bytes themselves or the path of the file holding them.
+    """
+    if len(content) <= OUTPUT_SPILL_BYTES:
+        return content
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=output_dir) as tmp:
+        tmp.write(content)
+        return tmp.name
+
+def output_data(output):
+    """File bytes of an output returned by keep_output()"""
+    if isinstance(output, bytes):
+        return output
+    with open(output, 'rb') as f:
+        return f.read()
+
+def spilled_files(outputs):
+    return [output for output in outputs if isinstance(output, str)]
+
+def process_files(main_file, sales_reco_file, main_sheet_name, sales_sheet_name, stage_graph=None,
+                  export_formats=(), history_run=None, output_dir=None):
+    """Build the complete and trimmed workbooks from two uploaded files without temporary files.
+
+    Sheets are parsed straight from the upload bytes. The chassis rows and the Location x
+    Model summary are also exported in every format of export_formats, and with a
+    (dealer, period, source file name) history_run the run's sums are added to the
+    history store.
+    Returns both workbooks as kept by keep_output(), the unmatched chassis rows, the
+    reconciliation checks and {file name: kept output} of the exports.
+    """
+    from export import table_bytes
+    from history import HistoryStore
+    from pipeline import StageGraph, report_bytes
+
+    main_content = main_file.read()
+    sales_content = sales_reco_file.read()
     
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_output:
-        output_file_path = tmp_output.name
-    
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_trim:
-        trim_file_path = tmp_trim.name
-    
-    try:
-        # Process the data (your original logic)
-        data = pd.read_excel(main_file_path, sheet_name=main_sheet_name, skiprows=6)
-        sales_reco_data = pd.read_excel(sales_file_path, sheet_name=sales_sheet_name)
-        data = drop_columns(data)
-        data = gst_calculation(data)
-        data['purchase -sales'] = 0
-        data = additional_columns(data)
-        data = dlr_calculation(data)
-        data = tata_share_calculation(data)
-        data['Margin'] = 0
-        data = fetching_discount_chassisno(data, sales_reco_data)
-        data = purchase_sales(data)
-        data = margin_calculation(data)
-        data = total_row(data)
-        chassis_file(data, output_file_path)
-        chassis_file_trim(data, trim_file_path)
-        summary(data, output_file_path)
-        verify_data(data, output_file_path)
-        
-        return output_file_path, trim_file_path
-        
-    except Exception as e:
-        # Cleanup temp files in case of error
-        for temp_file in [main_file_path, sales_file_path, output_file_path, trim_file_path]:
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
-        raise e
-    finally:
-        # Cleanup input temp files
-        for temp_file in [main_file_path, sales_file_path]:
-            if os.path.exists(temp_file):
-                os.unlink(temp_file)
+    # Only the stages whose inputs changed since the last run are recomputed
+    inputs = {
+        'main': (f'{content_key(main_content)}:{main_sheet_name}',
+                 lambda: cached_sheet(main_content, io.BytesIO(main_content), main_sheet_name, read_main_sheet)),
+        'reco': (f'{content_key(sales_content)}:{sales_sheet_name}',
+                 lambda: cached_sheet(sales_content, io.BytesIO(sales_content), sales_sheet_name, read_reco_sheet)),
+    }
+    results = (stage_graph or StageGraph()).compute(
+        ['chassis_data', 'unmatched', 'reconciliation', 'aggregates'], inputs)
+    # The workbooks are written outside the graph, which would keep their bytes in memory
+    # next to the spilled copies for as long as the session lasts
+    report, trim_report = report_bytes(results['chassis_data'], results['aggregates'])
+    output_file = keep_output(report, output_dir)
+    trim_file = keep_output(trim_report, output_dir)
+    exports = {}
+    for fmt in export_formats:
+        chassis, summary = table_bytes(results['chassis_data'], results['aggregates'], fmt)
+        exports[f'chassis.{fmt}'] = keep_output(chassis, output_dir, f'.{fmt}')
+        exports[f'summary.{fmt}'] = keep_output(summary, output_dir, f'.{fmt}')
+    if history_run:
+        dealer, period, source = history_run
+        HistoryStore(HISTORY_PATH).append(dealer, period, results['aggregates'], len(results['unmatched']), source)
+    return output_file, trim_file, results['unmatched'], results['reconciliation'], exports
 
 # Streamlit UI
 col1, col2 = st.columns(2)
@@ -402,32 +201,127 @@ if sales_reco_file:
         sales_sheet_name = sales_sheets[0]
         st.info(f"📋 Margin file has only one sheet: **{sales_sheet_name}**")
 
-if main_file and sales_reco_file and main_sheet_name and sales_sheet_name:
+# Check the header rows for the columns the analysis needs before anything is parsed
+schema_problems = []
+if main_file and main_sheet_name:
+    missing = missing_columns(sheet_header(main_file, main_sheet_name, MAIN_SHEET_SKIPROWS), REQUIRED_MAIN_COLUMNS)
+    if missing:
+        schema_problems.append(f"Main data sheet **{main_sheet_name}** has no column {', '.join(missing)} "
+                               f"in its header row (row {MAIN_SHEET_SKIPROWS + 1}).")
+if sales_reco_file and sales_sheet_name:
+    missing = missing_columns(sheet_header(sales_reco_file, sales_sheet_name), RECO_COLUMNS)
+    if missing:
+        schema_problems.append(f"Margin data sheet **{sales_sheet_name}** has no column {', '.join(missing)} "
+                               f"in its header row (row 1).")
+for problem in schema_problems:
+    st.error(f"❌ {problem}")
+
+if main_file and sales_reco_file and main_sheet_name and sales_sheet_name and not schema_problems:
     st.success("✅ Both files uploaded and sheets selected successfully!")
+    from export import EXPORT_FORMATS
+    from history import normalize_period
     
-    if st.button("🚀 Process Files", type="primary", use_container_width=True):
-        with st.spinner("Processing your files... This may take a few moments."):
+    with st.expander("📦 More outputs"):
+        export_formats = st.multiselect(
+            "Also export the chassis data and the Location x Model summary as:",
+            EXPORT_FORMATS,
+            format_func=str.upper,
+            help="Columnar files for BI tools, much faster to read than the workbooks"
+        )
+        save_history = st.checkbox(
+            "Save this run to the history store",
+            help=f"Keeps the Location x Model sums in {HISTORY_PATH} by dealer and month for trend queries"
+        )
+        history_run = None
+        if save_history:
+            dealer = st.text_input("Dealer:", value=os.path.splitext(main_file.name)[0]).strip()
+            period = st.text_input("Month (YYYY-MM):", value=datetime.date.today().strftime('%Y-%m'))
             try:
-                # Reset file pointers
-                main_file.seek(0)
-                sales_reco_file.seek(0)
-                
-                output_file_path, trim_file_path = process_files(main_file, sales_reco_file, main_sheet_name, sales_sheet_name)
-                
-                st.success("✨ Files processed successfully!")
-                
-                # Store file paths in session state for download
-                st.session_state.output_file_path = output_file_path
-                st.session_state.trim_file_path = trim_file_path
-                st.session_state.files_processed = True
-                        
-            except Exception as e:
-                st.error(f"❌ An error occurred while processing the files: {str(e)}")
-                st.info("Please check that your files are in the correct format and try again.")
+                history_run = (dealer, normalize_period(period), main_file.name) if dealer else None
+            except ValueError:
+                st.error(f"❌ '{period}' is not a month, e.g. 2024-03")
+            if not dealer:
+                st.error("❌ Enter a dealer name to save the run")
+
+    job = job_queue().get(st.session_state.get('job_id'))
+    if st.button("🚀 Process Files", type="primary", use_container_width=True,
+                 disabled=(job is not None and not job.done) or (save_history and history_run is None)):
+        # Stage results are kept per session so a rerun with one changed file reuses the rest
+        if 'stage_graph' not in st.session_state:
+            from pipeline import StageGraph
+            st.session_state.stage_graph = StageGraph()
+        args = (io.BytesIO(main_file.getvalue()), io.BytesIO(sales_reco_file.getvalue()),
+                main_sheet_name, sales_sheet_name, st.session_state.stage_graph, export_formats, history_run)
+        st.session_state.job_id = job_queue().submit(
+            process_files, args, label=main_file.name,
+            outputs=lambda result: spilled_files(list(result[:2]) + list(result[4].values())))
+        job = job_queue().get(st.session_state.job_id)
+
+    if job is not None and not job.done:
+        if job.status == 'queued':
+            st.info(f"⏳ Waiting for a free worker ({job_queue().running()} jobs running)...")
+        else:
+            stage = job.current_stage()
+            st.info(f"⚙️ Processing your files{f': {stage}' if stage else ''}... You can keep this page open.")
+            with st.expander("Progress"):
+                progress = [{'stage': stage, 'seconds': seconds} for stage, seconds in job.progress()]
+                st.dataframe(progress, use_container_width=True, hide_index=True)
+    elif job is not None:
+        if job.status == 'done':
+            output_file, trim_file, unmatched, reconciliation, exports = job.result
+            st.success("✨ Files processed successfully!")
+
+            # Keep the workbooks (or their spill files) in session state for download
+            st.session_state.output_file = output_file
+            st.session_state.trim_file = trim_file
+            st.session_state.unmatched_chassis = unmatched
+            st.session_state.reconciliation = reconciliation
+            st.session_state.exports = exports
+            st.session_state.profile = job.profiler
+            st.session_state.files_processed = True
+        else:
+            st.error(f"❌ An error occurred while processing the files: {job.error}")
+            st.info("Please check that your files are in the correct format and try again.")
+        # The session now holds the result; its spill files are deleted by the Clear button
+        job_queue().forget(job.id, keep_outputs=job.status == 'done')
+        del st.session_state['job_id']
 
 # Show download section if files are processed
 if st.session_state.get('files_processed', False):
     st.markdown("---")
+    unmatched = st.session_state.get('unmatched_chassis')
+    if unmatched is not None and len(unmatched) > 0:
+        st.warning(f"⚠️ {len(unmatched)} rows have no matching chassis number in the Chassis file and were left out of the analysis.")
+        with st.expander("Show unmatched chassis numbers"):
+            st.dataframe(unmatched, use_container_width=True)
+    
+    reconciliation = st.session_state.get('reconciliation')
+    if reconciliation is not None:
+        if not reconciliation['ok']:
+            st.warning(f"⚠️ The Difference sheet does not reconcile for: {', '.join(reconciliation['mismatched_locations']) or 'the total'}.")
+        with st.expander("🧮 Reconciliation"):
+            st.dataframe(reconciliation['locations'] + [reconciliation['total']],
+                         use_container_width=True, hide_index=True)
+            st.download_button(
+                label="📥 Download reconciliation (JSON)",
+                data=json.dumps(reconciliation, indent=2),
+                file_name="reconciliation.json",
+                mime="application/json",
+                key="download_reconciliation"
+            )
+    
+    profile = st.session_state.get('profile')
+    if profile is not None:
+        with st.expander(f"⏱️ Performance ({profile.total_seconds:.2f}s)"):
+            st.dataframe(profile.to_frame(), use_container_width=True, hide_index=True)
+            st.download_button(
+                label="📥 Download profile (JSON)",
+                data=profile.to_json(),
+                file_name="profile.json",
+                mime="application/json",
+                key="download_profile"
+            )
+    
     st.subheader("📁 Download Your Files")
     st.markdown("**Customize your file names before downloading:**")
     
@@ -446,15 +340,14 @@ if st.session_state.get('files_processed', False):
                 complete_filename += '.xlsx'
             
             try:
-                with open(st.session_state.output_file_path, 'rb') as f:
-                    st.download_button(
-                        label=f"📥 Download {complete_filename}",
-                        data=f.read(),
-                        file_name=complete_filename,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                        use_container_width=True,
-                        key="download_complete"
-                    )
+                st.download_button(
+                    label=f"📥 Download {complete_filename}",
+                    data=output_data(st.session_state.output_file),
+                    file_name=complete_filename,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True,
+                    key="download_complete"
+                )
             except:
                 st.error("Error reading complete analysis file")
     
@@ -471,37 +364,86 @@ if st.session_state.get('files_processed', False):
                 trim_filename += '.xlsx'
             
             try:
-                with open(st.session_state.trim_file_path, 'rb') as f:
+                st.download_button(
+                    label=f"📥 Download {trim_filename}",
+                    data=output_data(st.session_state.trim_file),
+                    file_name=trim_filename,
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    use_container_width=True,
+                    key="download_trim"
+                )
+            except:
+                st.error("Error reading trimmed analysis file")
+    
+    exports = st.session_state.get('exports')
+    if exports:
+        st.markdown("**Columnar exports:**")
+        for col, (file_name, output) in zip(st.columns(len(exports)), list(exports.items())):
+            with col:
+                try:
                     st.download_button(
-                        label=f"📥 Download {trim_filename}",
-                        data=f.read(),
-                        file_name=trim_filename,
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        label=f"📥 {file_name}",
+                        data=output_data(output),
+                        file_name=file_name,
+                        mime="text/csv" if file_name.endswith('.csv') else "application/octet-stream",
                         use_container_width=True,
-                        key="download_trim"
+                        key=f"download_{file_name}"
                     )
-            except:
-                st.error("Error reading trimmed analysis file")
+                except OSError:
+                    # The spill file expired; process the files again to get it back
+                    del exports[file_name]
+                    st.error(f"❌ {file_name} is no longer available, please process the files again")
     
     # Cleanup button
     if st.button("🗑️ Clear and Process New Files", type="secondary", use_container_width=True):
-        # Cleanup temp files
-        for temp_file in [st.session_state.get('output_file_path'), st.session_state.get('trim_file_path')]:
-            if temp_file and os.path.exists(temp_file):
+        # Cleanup spill files of large outputs
+        outputs = [st.session_state.get('output_file'), st.session_state.get('trim_file')]
+        for temp_file in spilled_files(outputs + list((st.session_state.get('exports') or {}).values())):
+            if os.path.exists(temp_file):
                 os.unlink(temp_file)
         
         # Clear session state
-        for key in ['output_file_path', 'trim_file_path', 'files_processed']:
+        if 'job_id' in st.session_state:
+            job_queue().forget(st.session_state.job_id)
+        for key in ['output_file', 'trim_file', 'unmatched_chassis', 'reconciliation', 'exports', 'profile', 'files_processed', 'job_id']:
             if key in st.session_state:
                 del st.session_state[key]
         
         st.rerun()
 
-elif main_file and sales_reco_file:
+elif main_file and sales_reco_file and not schema_problems:
     st.info("👆 Please select the appropriate sheets from both files to proceed.")
-else:
+elif not schema_problems:
     st.info("👆 Please upload both Excel files to begin processing.")
 
+# Trends across months saved to the history store, built from their stored sums
+if os.path.exists(HISTORY_PATH):
+    st.markdown("---")
+    st.subheader("📈 Compare Periods")
+    history = history_store()
+    runs = history.runs()
+    if runs.empty:
+        st.info("No runs saved to the history store yet.")
+    else:
+        dealer = st.selectbox("Dealer:", sorted(runs['dealer'].unique()), key="trend_dealer")
+        stored_periods = runs.loc[runs['dealer'] == dealer, 'period'].tolist()
+        periods = st.multiselect("Months to compare:", stored_periods, default=stored_periods, key="trend_periods")
+        if st.button("📊 Build Trend Workbook", disabled=len(periods) < 2, use_container_width=True):
+            from trend import write_trend
+            trend = io.BytesIO()
+            write_trend(history, dealer, trend, periods)
+            st.session_state.trend_file = (f"{dealer}_trend.xlsx", trend.getvalue())
+        if st.session_state.get('trend_file'):
+            trend_filename, trend_content = st.session_state.trend_file
+            st.download_button(
+                label=f"📥 Download {trend_filename}",
+                data=trend_content,
+                file_name=trend_filename,
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                use_container_width=True,
+                key="download_trend"
+            )
+
 # Add information section
 st.markdown("---")
 st.subheader("📋 About This Tool")
@@ -512,8 +454,15 @@ This tool processes vehicle sales data and generates comprehensive analysis repo
 - **Trimmed Analysis**: Filtered dataset removing columns with zero values
 - **Summary Sheet**: Location-wise model analysis with margins
 - **Difference Sheet**: Verification and reconciliation data
+- **Trend Workbook**: QTY, Net Margin and Per Car Margin per month for runs saved to history
 
 **File Requirements:**
 - Main data file should be similar to `Book1.xlsx` format
 - Margin file should contain a 'PV' sheet with chassis numbers and discount data
 """)
+
+# Check on a running job again shortly; the page stays usable in the meantime
+job = job_queue().get(st.session_state.get('job_id'))
+if job is not None and not job.done:
+    time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
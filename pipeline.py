@@ -0,0 +1,323 @@
+import functools
+import hashlib
+import io
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from aggregate import ChassisAggregates, reconcile
+from cache import frame_size
+from ingest import DROPPED_COLUMNS
+from profiling import active_profiler, measure, profiled, result_shape
+from reco_index import ChassisIndex
+from report import ReportBuilder, chassis_file, chassis_file_trim, summary, verify_data
+
+@profiled('drop_columns')
+def drop_columns(data):
+    # Only drop columns that exist in the dataframe
+    existing_columns = [col for col in DROPPED_COLUMNS if col in data.columns]
+    return data.drop(columns=existing_columns, axis=1)
+
+# Text columns stored as categoricals by compact_dtypes(), when their values repeat
+CATEGORY_COLUMNS = ['Location', 'Model']
+# Integer columns are stored as int32 when every value is below this magnitude, so a
+# sum or difference of two such columns computed in int32 cannot overflow
+INT32_LIMIT = 2**30
+
+def compact_dtypes(data):
+    """Store the main sheet in smaller dtypes without changing any value.
+
+    Location and Model become categoricals, ChassisNo an Arrow-backed string column
+    when pyarrow is installed, and int64 columns int32 where that is lossless. Floats
+    stay float64: with float32 the later stages would compute in float32 as well and
+    the rounded results could change. The memory saved is recorded as saved_mb on the
+    active profiler.
+    """
+    with measure('compact_dtypes') as record:
+        before = frame_size(data)
+        dtypes = {}
+        for col in data.columns:
+            series = data[col]
+            if col in CATEGORY_COLUMNS and pd.api.types.infer_dtype(series, skipna=True) == 'string':
+                if series.nunique() <= len(series) // 2:
+                    dtypes[col] = 'category'
+            elif col == 'ChassisNo' and pd.api.types.infer_dtype(series, skipna=True) == 'string':
+                if pyarrow_available():
+                    dtypes[col] = 'string[pyarrow]'
+            elif series.dtype == np.int64 and (series.abs() < INT32_LIMIT).all():
+                dtypes[col] = np.int32
+        data = data.astype(dtypes)
+        record['saved_mb'] = round((before - frame_size(data)) / 2**20, 2)
+    return data
+
+def pyarrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+@profiled('gst_calculation')
+def gst_calculation(data):
+    data['gst'] = data['GST%'] + data['CESS%'] + 100
+    return data
+
+# Share columns are normalized to their pre-GST value, round(value * 100 / gst), into a copy
+# named after the column plus a trailing space. Rules apply in order and each one scans the
+# columns present after the previous rule, including the normalized copies it added.
+SHARE_RULES = [
+    {'keywords': ['Additional'], 'case_sensitive': True, 'total': None},
+    {'keywords': ['dlr', 'dealer'], 'case_sensitive': False, 'total': 'TOTAL DLR SHARE'},
+    {'keywords': ['tata', 'mfr', 'mfg', 'manuf(+)'], 'case_sensitive': False, 'total': 'TOTAL TATA SHARE'},
+]
+
+def rule_matches(rule, column):
+    name = column if rule['case_sensitive'] else column.lower()
+    return any(keyword in name for keyword in rule['keywords'])
+
+@functools.lru_cache(maxsize=64)
+def share_plan(columns):
+    """Source columns of every rule in SHARE_RULES for one header layout (a tuple of column names).
+
+    A rule is chained when one of its sources is the normalized copy of another source
+    of the same rule, so its columns have to be computed one after the other.
+    """
+    columns = list(columns)
+    plan = []
+    for rule in SHARE_RULES:
+        sources = tuple(col for col in columns if rule_matches(rule, col))
+        chained = any(col + " " in sources[j + 1:] for j, col in enumerate(sources))
+        plan.append((sources, chained))
+        columns += [col + " " for col in sources if col + " " not in columns]
+        if rule['total'] and rule['total'] not in columns:
+            columns.append(rule['total'])
+    return tuple(plan)
+
+@profiled('share_calculation')
+def share_calculation(data):
+    plan = share_plan(tuple(data.columns))
+    gst = data['gst'].to_numpy(dtype=float)[:, None]
+    new_columns = {}
+    replaced = {}
+
+    def current(col):
+        # A source may be a normalized copy made by an earlier rule
+        if col in replaced:
+            return replaced[col]
+        return new_columns[col] if col in new_columns else data[col].to_numpy(dtype=float)
+
+    def store(col, values):
+        target = replaced if col in data.columns else new_columns
+        target[col] = values
+
+    for rule, (sources, chained) in zip(SHARE_RULES, plan):
+        if chained:
+            normalized = []
+            for col in sources:
+                store(col + " ", np.round(current(col) * 100 / gst[:, 0]))
+                normalized.append(current(col + " "))
+            normalized = np.column_stack(normalized)
+        elif sources:
+            if any(col in new_columns or col in replaced for col in sources):
+                block = np.column_stack([current(col) for col in sources])
+            else:
+                block = data[list(sources)].to_numpy(dtype=float)
+            normalized = np.round(block * 100 / gst)
+            for j, col in enumerate(sources):
+                store(col + " ", normalized[:, j])
+        if rule['total']:
+            store(rule['total'], normalized.sum(axis=1) if sources else 0)
+    for col, values in replaced.items():
+        data[col] = values
+    return pd.concat([data, pd.DataFrame(new_columns, index=data.index)], axis=1)
+
+def chassis_index(sales_reco_data):
+    # Accept either a reconciliation sheet or an already built ChassisIndex
+    if isinstance(sales_reco_data, ChassisIndex):
+        return sales_reco_data
+    return ChassisIndex.from_sheet(sales_reco_data)
+
+@profiled('fetching_discount_chassisno')
+def fetching_discount_chassisno(data, sales_reco_data):
+    index = chassis_index(sales_reco_data)
+
+    # Keeping only rows whose ChassisNo is in the reconciliation data
+    data_filtered = data[index.positions(data['ChassisNo']) >= 0].copy()
+
+    # Joining the discount through the index
+    data_filtered['Total Discount'] = index.lookup(data_filtered['ChassisNo'])
+    data_filtered['Total Discount'] = data_filtered['Total Discount'] * data_filtered['COUNT']
+
+    return data_filtered
+
+@profiled('unmatched_chassis')
+def unmatched_chassis(data, sales_reco_data):
+    """Rows of the main sheet whose ChassisNo has no reconciliation entry"""
+    index = chassis_index(sales_reco_data)
+    columns = [col for col in ['SNO', 'Location', 'Model', 'ChassisNo'] if col in data.columns]
+    return data.loc[index.positions(data['ChassisNo']) < 0, columns].reset_index(drop=True)
+
+@profiled('purchase_sales')
+def purchase_sales(data):
+    data['purchase -sales'] = round(data['Sale Price(+)'] - data['Purchase Price(-)'] - data['Total Discount'])
+    return data
+
+@profiled('margin_calculation')
+def margin_calculation(data):
+    data['Margin'] = round(data['purchase -sales'] - data['AdditionalDiscount '] - data['TOTAL DLR SHARE'] - 
+                           data['AdditionalFreeAcc(-) '] - data['DSAComission(-)'])
+    return data
+
+@profiled('total_row')
+def total_row(data):
+    # Sum every row; the data is filtered, so its index labels no longer run 0..len-1
+    total = data.select_dtypes(include='number')
+    total = total.drop(columns=['SNO'], axis=1, errors='ignore')
+    total = total.sum()
+    total_row = {}
+    for col in data.columns:
+        if col in total.index:
+            total_row[col] = total[col]
+        elif col.lower() == 'sno':
+            total_row[col] = len(data)
+        elif col.lower() == 'location':
+            total_row[col] = f'Total ({len(data)})'
+    total_row_df = pd.DataFrame([total_row], columns=list(total_row.keys()))
+    for col in total_row_df.columns:
+        # A categorical column (see compact_dtypes) stays categorical with the totals label added
+        if isinstance(data[col].dtype, pd.CategoricalDtype):
+            categories = data[col].cat.categories.union(total_row_df[col].dropna())
+            data[col] = data[col].cat.set_categories(categories)
+            total_row_df[col] = total_row_df[col].astype(data[col].dtype)
+    data = pd.concat([data, total_row_df], ignore_index=True)
+    data = data.rename(columns={'Total Discount': 'Tata DMS Credit'})
+    return data
+
+def prepare_data(data):
+    """Stages that only depend on the main sheet"""
+    data = drop_columns(data)
+    data = compact_dtypes(data)
+    data = gst_calculation(data)
+    data['purchase -sales'] = 0
+    data = share_calculation(data)
+    data['Margin'] = 0
+    return data
+
+def reconcile_data(data, sales_reco_data):
+    """Stages that join the prepared main sheet with the reconciliation data"""
+    data = fetching_discount_chassisno(data, sales_reco_data)
+    data = purchase_sales(data)
+    data = margin_calculation(data)
+    data = total_row(data)
+    return data
+
+def process_data(data, sales_reco_data):
+    """Run every calculation stage on the parsed main and Chassis/PV sheets.
+
+    sales_reco_data may also be a ChassisIndex. Returns the chassis-level data with
+    its totals row and the main sheet rows that were dropped for lack of a
+    reconciliation entry.
+    """
+    index = chassis_index(sales_reco_data)
+    data = prepare_data(data)
+    unmatched = unmatched_chassis(data, index)
+    data = reconcile_data(data, index)
+    return data, unmatched
+
+@profiled('aggregates')
+def chassis_aggregates(data):
+    return ChassisAggregates.from_data(data)
+
+def build_reports(data, aggregates=None, width_sample_rows=None, max_column_width=None):
+    """Complete workbook (detail, Summary and Difference sheets) plus the trimmed detail sheet.
+
+    width_sample_rows and max_column_width are passed on to ReportBuilder, for sheets
+    too large to measure every cell of.
+    """
+    aggregates = aggregates or chassis_aggregates(data)
+    report = ReportBuilder(width_sample_rows, max_column_width)
+    chassis_file(data, report)
+    chassis_file_trim(data, report)
+    summary(data, report, aggregates)
+    verify_data(data, report, aggregates)
+    return report
+
+@profiled('reports')
+def report_bytes(data, aggregates=None):
+    """Complete and trimmed workbook as bytes, written in one pass"""
+    output = io.BytesIO()
+    trim_output = io.BytesIO()
+    build_reports(data, aggregates).save(output, trim_output)
+    return output.getvalue(), trim_output.getvalue()
+
+def write_reports(data, output_file, trim_file, aggregates=None, width_sample_rows=None, max_column_width=None):
+    """Write the complete workbook and the trimmed one to file paths or binary file objects"""
+    build_reports(data, aggregates, width_sample_rows, max_column_width).save(output_file, trim_file)
+
+# Stage graph of the pipeline: stage -> (inputs, function). 'main' and 'reco' are the
+# parsed main and reconciliation sheets, supplied by the caller of StageGraph.compute().
+STAGES = {
+    'prepared': (('main',), prepare_data),
+    'chassis_index': (('reco',), chassis_index),
+    'unmatched': (('prepared', 'chassis_index'), unmatched_chassis),
+    'chassis_data': (('prepared', 'chassis_index'), reconcile_data),
+    'aggregates': (('chassis_data',), chassis_aggregates),
+    'reconciliation': (('aggregates',), reconcile),
+}
+
+class StageGraph:
+    """Runs STAGES lazily and memoizes every stage result by input fingerprint.
+
+    A stage's fingerprint hashes its name with the fingerprints of its inputs, so a new
+    reconciliation sheet reuses 'prepared' and only recomputes the stages below
+    'chassis_index'. Only the stages needed for the requested targets run, and input
+    loaders are only called when a stage that needs them is not memoized. Memoized
+    results are shared between runs and must not be modified.
+    """
+
+    def __init__(self, stages=STAGES, max_results=16):
+        self.stages = stages
+        self.max_results = max_results
+        self.results = OrderedDict()
+        self.last_run = {}
+
+    def fingerprint(self, name, inputs):
+        if name in inputs:
+            return inputs[name][0]
+        deps = self.stages[name][0]
+        text = '|'.join([name] + [self.fingerprint(dep, inputs) for dep in deps])
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def compute(self, targets, inputs):
+        """Return {target: result}; inputs maps 'main'/'reco' to (fingerprint, loader)"""
+        values = {}
+        self.last_run = {}
+
+        def resolve(name):
+            if name in values:
+                return values[name]
+            if name in inputs:
+                values[name] = inputs[name][1]()
+                return values[name]
+            key = (name, self.fingerprint(name, inputs))
+            if key in self.results:
+                self.results.move_to_end(key)
+                result = self.results[key]
+                self.last_run[name] = 'cached'
+                if active_profiler():
+                    active_profiler().record_cached(name)
+            else:
+                deps, func = self.stages[name]
+                args = [resolve(dep) for dep in deps]
+                with measure(name) as record:
+                    result = func(*args)
+                    record.update(result_shape(result))
+                self.results[key] = result
+                self.last_run[name] = 'computed'
+                while len(self.results) > self.max_results:
+                    self.results.popitem(last=False)
+            values[name] = result
+            return result
+
+        return {target: resolve(target) for target in targets}
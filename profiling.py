@@ -0,0 +1,165 @@
+import contextvars
+import cProfile
+import functools
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_active_profiler = contextvars.ContextVar('active_profiler', default=None)
+
+# How often the sampler thread reads the process RSS while a profiler is active
+RSS_SAMPLE_SECONDS = 0.01
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # No /proc: fall back to the high-water mark, which only shows new peaks
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def result_shape(result):
+    # Row and column count of a DataFrame result, or of the first item of a tuple result
+    if isinstance(result, tuple) and result:
+        result = result[0]
+    # A DataFrame result means pandas is already imported; stages never import it just for this
+    pd = sys.modules.get('pandas')
+    if pd is not None and isinstance(result, pd.DataFrame):
+        return {'rows': len(result), 'columns': len(result.columns)}
+    return {}
+
+class StageProfiler:
+    """Records wall time, peak memory and output shape of each pipeline stage.
+
+    Activate it around a run; every profiled() function and measure() block called
+    from the same thread or task is recorded, nested stages with their depth. Memory
+    is the peak process RSS above the stage's starting RSS, sampled by a background
+    thread every RSS_SAMPLE_SECONDS. With cprofile=True the whole run is also
+    profiled by cProfile, which slows it down considerably.
+    """
+
+    def __init__(self, track_memory=True, cprofile=False):
+        self.track_memory = track_memory
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.stages = []
+        self.stack = []
+        self.total_seconds = 0.0
+        self.peak_rss_mb = None
+        self._sampling = None
+
+    def _sample_rss(self, stop):
+        while not stop.wait(RSS_SAMPLE_SECONDS):
+            rss = current_rss()
+            for frame in list(self.stack):
+                frame['peak'] = max(frame['peak'], rss)
+
+    @contextmanager
+    def activate(self):
+        token = _active_profiler.set(self)
+        stop = threading.Event()
+        if self.track_memory:
+            sampler = threading.Thread(target=self._sample_rss, args=(stop,), daemon=True)
+            sampler.start()
+        if self.cprofile:
+            self.cprofile.enable()
+        start = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.total_seconds += time.perf_counter() - start
+            if self.cprofile:
+                self.cprofile.disable()
+            stop.set()
+            _active_profiler.reset(token)
+
+    @contextmanager
+    def measure(self, name):
+        record = {'stage': name, 'depth': len(self.stack), 'status': 'computed'}
+        frame = {'peak': 0, 'start': 0}
+        if self.track_memory:
+            frame['start'] = frame['peak'] = current_rss()
+        self.stack.append(frame)
+        self.stages.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 4)
+            self.stack.pop()
+            if self.track_memory:
+                peak = max(frame['peak'], current_rss())
+                record['peak_mb'] = round((peak - frame['start']) / 2**20, 2)
+                self.peak_rss_mb = max(self.peak_rss_mb or 0, round(peak / 2**20, 1))
+
+    def record_cached(self, name):
+        self.stages.append({'stage': name, 'depth': len(self.stack), 'status': 'cached', 'seconds': 0.0})
+
+    def to_frame(self):
+        import pandas as pd
+
+        columns = ['stage', 'depth', 'status', 'seconds', 'peak_mb', 'rows', 'columns', 'saved_mb']
+        frame = pd.DataFrame(self.stages).reindex(columns=columns)
+        frame['stage'] = ['    ' * int(depth) + stage for stage, depth in zip(frame['stage'], frame['depth'])]
+        frame[['rows', 'columns']] = frame[['rows', 'columns']].astype('Int64')
+        return frame.drop(columns='depth')
+
+    def to_dict(self):
+        import pandas as pd
+
+        return {
+            'total_seconds': round(self.total_seconds, 4),
+            'peak_rss_mb': self.peak_rss_mb,
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'stages': self.stages,
+        }
+
+    def to_json(self, path=None):
+        text = json.dumps(self.to_dict(), indent=2)
+        if path:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def dump_cprofile(self, path):
+        if self.cprofile:
+            self.cprofile.dump_stats(path)
+
+def active_profiler():
+    return _active_profiler.get()
+
+@contextmanager
+def measure(name):
+    """Record the enclosed block as a stage of the active profiler, if any"""
+    profiler = _active_profiler.get()
+    if profiler is None:
+        yield {}
+        return
+    with profiler.measure(name) as record:
+        yield record
+
+def profiled(name):
+    """Decorator recording each call as a stage; DataFrame results add their shape"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _active_profiler.get()
+            if profiler is None:
+                return func(*args, **kwargs)
+            with profiler.measure(name) as record:
+                result = func(*args, **kwargs)
+                record.update(result_shape(result))
+            return result
+        return wrapper
+    return decorator
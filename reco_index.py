@@ -0,0 +1,81 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+def resolve_discounts(sales_reco_data):
+    """One Total Discount per Chassis_No: the lowest non-blank discount of its rows.
+
+    Rows without a chassis number are ignored. The result is indexed by Chassis_No,
+    sorted when the chassis numbers are comparable.
+    """
+    clean_sales = sales_reco_data[['Chassis_No', 'Total Discount']].dropna(subset=['Chassis_No'])
+    discounts = clean_sales.groupby('Chassis_No', sort=False)['Total Discount'].min()
+    try:
+        discounts = discounts.sort_index()
+    except TypeError:
+        # Mixed numeric and text chassis numbers cannot be ordered
+        pass
+    return discounts
+
+class ChassisIndex:
+    """Chassis_No -> Total Discount lookup used to reconcile the main sales sheet.
+
+    Built from one reconciliation sheet with from_sheet(), or kept in a SQLite file
+    with open() and grown month to month with update(): chassis numbers in the new
+    sheet are inserted or overwritten, all others keep their earlier discount.
+    """
+
+    def __init__(self, discounts, path=None):
+        self.discounts = discounts
+        self.path = path
+
+    @classmethod
+    def from_sheet(cls, sales_reco_data):
+        return cls(resolve_discounts(sales_reco_data))
+
+    @classmethod
+    def open(cls, path):
+        with sqlite3.connect(path) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS chassis_discount '
+                         '(chassis_no PRIMARY KEY, total_discount REAL) WITHOUT ROWID')
+            rows = conn.execute('SELECT chassis_no, total_discount FROM chassis_discount ORDER BY chassis_no').fetchall()
+        discounts = pd.Series([r[1] for r in rows], index=pd.Index([r[0] for r in rows], name='Chassis_No'),
+                              name='Total Discount', dtype=float)
+        return cls(discounts, path)
+
+    def __len__(self):
+        return len(self.discounts)
+
+    def update(self, sales_reco_data):
+        """Merge a reconciliation sheet into the index; returns how many chassis were added or changed"""
+        new = resolve_discounts(sales_reco_data)
+        current = self.discounts.reindex(new.index)
+        same = (current == new) | (current.isna() & new.isna() & new.index.isin(self.discounts.index))
+        changed = new[~same]
+        if changed.empty:
+            return 0
+        merged = pd.concat([self.discounts.drop(changed.index, errors='ignore'), changed])
+        try:
+            merged = merged.sort_index()
+        except TypeError:
+            pass
+        self.discounts = merged.rename('Total Discount').rename_axis('Chassis_No')
+        if self.path:
+            values = [None if pd.isna(v) else float(v) for v in changed.values]
+            with sqlite3.connect(self.path) as conn:
+                conn.executemany('INSERT OR REPLACE INTO chassis_discount (chassis_no, total_discount) VALUES (?, ?)',
+                                 zip(changed.index.tolist(), values))
+        return len(changed)
+
+    def positions(self, chassis):
+        # Position of each chassis number in the index, -1 when it is not reconciled
+        return self.discounts.index.get_indexer(chassis)
+
+    def lookup(self, chassis):
+        """Discount per chassis number, NaN when missing"""
+        positions = self.positions(chassis)
+        found = positions >= 0
+        discounts = np.full(len(positions), np.nan)
+        discounts[found] = self.discounts.to_numpy(dtype=float)[positions[found]]
+        return discounts
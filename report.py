@@ -0,0 +1,399 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, Side
+from openpyxl.utils import get_column_letter
+
+from aggregate import ChassisAggregates
+from profiling import profiled
+
+# Same look pandas gives header and index cells in DataFrame.to_excel
+HEADER_FONT = Font(bold=True)
+HEADER_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+HEADER_ALIGNMENT = Alignment(horizontal='center', vertical='top')
+DATETIME_FORMAT = 'YYYY-MM-DD HH:MM:SS'
+DATE_FORMAT = 'YYYY-MM-DD'
+
+def _cell_value(value):
+    # Convert a DataFrame value the way DataFrame.to_excel does
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isinf(value):
+        return 'inf' if value > 0 else '-inf'
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value
+
+def _text_length(value):
+    # Length of the value as it reads back from the saved workbook
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return len(str(value))
+    if isinstance(value, (int, float)):
+        text = '%.16g' % value
+        return len(str(float(text))) if any(c in text for c in '.eE') else len(str(int(text)))
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return len(str(datetime.datetime.combine(value, datetime.time())))
+    return len(str(value))
+
+POWERS_OF_TEN = 10 ** np.arange(16, dtype=np.int64)
+
+def _number_lengths(values):
+    # Vectorized _text_length for a float array without missing values
+    lengths = np.zeros(len(values), dtype=np.int64)
+    finite = np.isfinite(values)
+    exact = finite & (np.abs(values) < 1e16) & (values == np.trunc(values))
+    if (finite & ~exact).any():
+        # openpyxl stores 16 significant digits, which may turn the value into a whole number
+        values = values.copy()
+        values[finite & ~exact] = np.char.mod('%.16g', values[finite & ~exact]).astype(float)
+    whole = finite & (np.abs(values) < 1e16) & (values == np.trunc(values))
+    digits = np.abs(values[whole]).astype(np.int64)
+    lengths[whole] = np.maximum(np.searchsorted(POWERS_OF_TEN, digits, side='right'), 1) + (values[whole] < 0)
+    lengths[whole & (values == 0)] = 1
+    inf = np.isinf(values)
+    lengths[inf] = np.where(values[inf] > 0, 3, 4)
+    rest = finite & ~whole
+    if rest.any():
+        lengths[rest] = np.char.str_len(values[rest].astype(str))
+    return lengths
+
+def series_lengths(series, count_empty=False):
+    """Text length of every cell in a column, computed with vectorized ops.
+
+    Empty cells measure as 'None' with count_empty, otherwise empty and zero cells measure 0.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Measure each category once; the appended length is for missing values (code -1)
+        category_lengths = series_lengths(pd.Series(series.cat.categories), count_empty)
+        category_lengths = np.append(category_lengths, len(str(None)) if count_empty else 0)
+        return category_lengths[series.cat.codes.to_numpy()]
+    empty = series.isna().to_numpy()
+    lengths = np.zeros(len(series), dtype=np.int64)
+    present = series[~empty]
+    if pd.api.types.is_bool_dtype(series):
+        flags = present.to_numpy(dtype=bool)
+        lengths[~empty] = np.where(flags, 4, 5) if count_empty else np.where(flags, 4, 0)
+    elif pd.api.types.is_numeric_dtype(series):
+        values = present.to_numpy(dtype=float)
+        lengths[~empty] = _number_lengths(values) if count_empty else np.where(values == 0, 0, _number_lengths(values))
+    elif pd.api.types.is_datetime64_any_dtype(series):
+        lengths[~empty] = len(str(datetime.datetime(2000, 1, 1)))
+    elif pd.api.types.infer_dtype(present, skipna=False) == 'string':
+        lengths[~empty] = present.str.len().to_numpy()
+        empty[~empty] = lengths[~empty] == 0
+    else:
+        measured = np.array([_text_length(v) if (count_empty or v) else 0 for v in map(_cell_value, present)], dtype=object)
+        blank = np.array([m is None for m in measured], dtype=bool)
+        lengths[~empty] = np.where(blank, 0, measured).astype(np.int64)
+        empty[~empty] = blank
+    if count_empty:
+        lengths[empty] = len(str(None))
+    return lengths
+
+def column_widths(frame, index=False, header=True, count_empty=False, sample_rows=None):
+    """Longest cell text per sheet column for a DataFrame laid out like DataFrame.to_excel.
+
+    With sample_rows, lengths come from that many evenly spaced rows (always
+    including the first and last) instead of every row.
+    """
+    if sample_rows and len(frame) > sample_rows:
+        frame = frame.iloc[np.unique(np.linspace(0, len(frame) - 1, sample_rows).astype(int))]
+    columns = [frame.index.to_series()] if index else []
+    columns += [frame.iloc[:, j] for j in range(len(frame.columns))]
+    widths = [int(series_lengths(col, count_empty).max(initial=0)) for col in columns]
+    if header:
+        names = ([frame.index.name] if index else []) + list(frame.columns)
+        for j, name in enumerate(names):
+            length = _text_length(_cell_value(name)) if (count_empty or name) else 0
+            widths[j] = max(widths[j], len(str(None)) if length is None else length)
+    return widths
+
+class _Block:
+    """One DataFrame placed on a sheet, laid out like DataFrame.to_excel"""
+
+    def __init__(self, frame, startrow, startcol, index, header):
+        self.frame = frame
+        self.startrow = startrow
+        self.startcol = startcol
+        self.index = index
+        self.header = header
+        self.nrows = len(frame) + (1 if header else 0)
+        self.ncols = len(frame.columns) + (1 if index else 0)
+
+    def header_row(self):
+        row = [self.frame.index.name] if self.index else []
+        return row + list(self.frame.columns)
+
+    def rows(self):
+        # Yields (values, styled) per row, where styled flags header/index cells
+        if self.header:
+            yield [_cell_value(v) for v in self.header_row()], True
+        for values in self.frame.itertuples(index=self.index, name=None):
+            yield [_cell_value(v) for v in values], False
+
+class _ChunkBlock:
+    """Rows streamed from DataFrame chunks that share one set of columns, laid out like _Block.
+
+    chunks is a callable returning an iterable of DataFrames, so the rows can be
+    written more than once without holding them in memory.
+    """
+
+    def __init__(self, columns, chunks, nrows, startrow, startcol, header):
+        self.columns = list(columns)
+        self.chunks = chunks
+        self.startrow = startrow
+        self.startcol = startcol
+        self.index = False
+        self.header = header
+        self.nrows = nrows + (1 if header else 0)
+        self.ncols = len(self.columns)
+
+    def rows(self):
+        if self.header:
+            yield [_cell_value(v) for v in self.columns], True
+        for chunk in self.chunks():
+            for values in chunk.reindex(columns=self.columns).itertuples(index=False, name=None):
+                yield [_cell_value(v) for v in values], False
+
+class ReportBuilder:
+    """Collects the sheets of one workbook in memory and writes it in a single pass.
+
+    Column widths are measured from the DataFrames; width_sample_rows limits how many
+    rows per block are measured and max_column_width caps the result, for very large sheets.
+    """
+
+    def __init__(self, width_sample_rows=None, max_column_width=None):
+        self.sheets = {}
+        self.widths = {}
+        self.trimmed = {}
+        self.width_sample_rows = width_sample_rows
+        self.max_column_width = max_column_width
+
+    def add_frame(self, sheet_name, frame, startrow=0, startcol=0, index=False, header=True):
+        self.sheets.setdefault(sheet_name, []).append(_Block(frame, startrow, startcol, index, header))
+
+    def add_chunks(self, sheet_name, columns, chunks, nrows, startrow=0, startcol=0, header=True):
+        """Add nrows rows streamed from chunks(), see _ChunkBlock; set the widths with fit_lengths()"""
+        self.sheets.setdefault(sheet_name, []).append(_ChunkBlock(columns, chunks, nrows, startrow, startcol, header))
+
+    def fit_lengths(self, sheet_name, lengths):
+        # Widths from cell text lengths measured elsewhere, e.g. while the chunks were produced
+        widths = np.asarray(lengths, dtype=np.int64) + 2
+        if self.max_column_width:
+            widths = np.minimum(widths, self.max_column_width)
+        self.widths[sheet_name] = widths.tolist()
+
+    @profiled('autofit')
+    def autofit(self, sheet_name, count_empty=False):
+        # Width = longest cell text + 2, see column_widths() for how cells measure
+        blocks = self.sheets[sheet_name]
+        nrows = max(b.startrow + b.nrows for b in blocks)
+        ncols = max(b.startcol + b.ncols for b in blocks)
+        empty_length = len(str(None)) if count_empty else 0
+        lengths = np.zeros(ncols, dtype=np.int64)
+        covered = np.zeros(ncols, dtype=np.int64)
+        for block in blocks:
+            widths = column_widths(block.frame, block.index, block.header, count_empty, self.width_sample_rows)
+            span = slice(block.startcol, block.startcol + block.ncols)
+            lengths[span] = np.maximum(lengths[span], widths)
+            covered[span] += block.nrows
+        lengths[covered < nrows] = np.maximum(lengths[covered < nrows], empty_length)
+        self.fit_lengths(sheet_name, lengths)
+
+    def _write_sheet(self, sheets, blocks):
+        # sheets holds (worksheet, kept column positions or None) pairs, all written from
+        # the same converted cells, so a trimmed copy costs only its own serialization
+        for ws, keep in sheets:
+            widths = self.widths.get(ws.title, [])
+            if keep is not None:
+                widths = [widths[j] for j in keep if j < len(widths)]
+            for col, width in enumerate(widths, start=1):
+                ws.column_dimensions[get_column_letter(col)].width = width
+        ncols = max(b.startcol + b.ncols for b in blocks)
+        nrows = max(b.startrow + b.nrows for b in blocks)
+        pending = sorted(blocks, key=lambda b: b.startrow)
+        active = []
+        for row in range(nrows):
+            while pending and pending[0].startrow == row:
+                block = pending.pop(0)
+                active.append((block, block.rows()))
+            cells = [None] * ncols
+            # Positions of header/index cells and date cells, which need a styled cell per worksheet
+            styled_cells = []
+            date_cells = []
+            still_active = []
+            for block, rows in active:
+                values, styled = next(rows, (None, None))
+                if values is None:
+                    continue
+                still_active.append((block, rows))
+                for offset, value in enumerate(values):
+                    if styled or (block.index and offset == 0):
+                        styled_cells.append(block.startcol + offset)
+                    elif isinstance(value, datetime.date):
+                        date_cells.append(block.startcol + offset)
+                    cells[block.startcol + offset] = value
+            active = still_active
+            for ws, keep in sheets:
+                values = cells
+                if styled_cells or date_cells:
+                    values = list(cells)
+                    for col in styled_cells:
+                        values[col] = self._styled_cell(ws, cells[col])
+                    for col in date_cells:
+                        values[col] = self._date_cell(ws, cells[col])
+                ws.append(values if keep is None else [values[j] for j in keep])
+
+    def _styled_cell(self, ws, value):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.font = HEADER_FONT
+        cell.border = HEADER_BORDER
+        cell.alignment = HEADER_ALIGNMENT
+        return cell
+
+    def _date_cell(self, ws, value):
+        cell = WriteOnlyCell(ws, value=value)
+        cell.number_format = DATETIME_FORMAT if isinstance(value, datetime.datetime) else DATE_FORMAT
+        return cell
+
+    def trim(self, sheet_name, columns):
+        """Also write sheet_name, reduced to the given column positions, to the trimmed workbook of save()"""
+        self.trimmed[sheet_name] = [int(j) for j in columns]
+
+    @profiled('write workbook')
+    def save(self, target, trim_target=None):
+        # Targets are file paths or binary file objects such as io.BytesIO. With trim_target,
+        # the sheets registered with trim() are written there in the same pass.
+        wb = Workbook(write_only=True)
+        trim_wb = Workbook(write_only=True) if trim_target is not None else None
+        for sheet_name, blocks in self.sheets.items():
+            sheets = [(wb.create_sheet(title=sheet_name), None)]
+            if trim_wb is not None and sheet_name in self.trimmed:
+                sheets.append((trim_wb.create_sheet(title=sheet_name), self.trimmed[sheet_name]))
+            self._write_sheet(sheets, blocks)
+        wb.save(target)
+        if trim_wb is not None:
+            trim_wb.save(trim_target)
+
+@profiled('chassis_file')
+def chassis_file(data, report):
+    report.add_frame('Sheet1', data)
+    report.autofit('Sheet1', count_empty=True)
+
+def zero_total_columns(data):
+    """Boolean mask of the columns whose value in the totals row (the last row) is 0"""
+    totals = data.iloc[-1:].select_dtypes(include='number')
+    zero = totals.columns[totals.iloc[0].to_numpy() == 0] if len(totals) else []
+    return data.columns.isin(zero)
+
+@profiled('chassis_file_trim')
+def chassis_file_trim(data, report):
+    # The trimmed workbook is the detail sheet without its zero-total columns; it is
+    # written by report.save() from the cells and widths of chassis_file(), which runs first
+    report.trim('Sheet1', np.flatnonzero(~zero_total_columns(data)))
+
+@profiled('summary')
+def summary(data, report, aggregates=None):
+    # aggregates (a ChassisAggregates) is computed from data when not given
+    aggregates = aggregates or ChassisAggregates.from_data(data)
+    sheet_name = 'Summary'
+    row_spacing = 2
+    summary_data = aggregates.location_model()
+    current_row = 1
+
+    for i, show_rm in summary_data.groupby(level='Location', sort=True, observed=True):
+        show_rm = show_rm.reset_index()
+
+        sr_df1 = pd.DataFrame({
+            'MODEL': show_rm['Model'],
+            'QTY': show_rm['QTY'],
+            'SALE-PUR DIFF': show_rm['SALE-PUR DIFF'],
+            'Additional Discount': show_rm['Additional Discount'],
+            'Additional Accessories Discount': show_rm['Additional Accessories Discount'],
+            'DSA Commission': show_rm['DSA Commission'],
+            'Dlr share in Retail Support': show_rm['Dlr share in Retail Support'],
+            'Net Margin': show_rm['Net Margin']
+        })
+        sr_df1['Per Car Margin'] = round(sr_df1['Net Margin'] / sr_df1['QTY'],0)
+        total_row = round(sr_df1.select_dtypes(include='number').drop(columns='Per Car Margin').sum(),0)
+        total_row['Per Car Margin'] = round(total_row['Net Margin'] / total_row['QTY'],0)
+        total_row['MODEL'] = 'TOTAL'
+        sr_df1.loc[len(sr_df1)] = total_row
+
+        sr_df2 = pd.DataFrame({
+            'TATA RETAIL SUPPORT': show_rm['TATA RETAIL SUPPORT'],
+            'MFG share in Retail Support CREDIT IN TATA PUR': show_rm['MFG share in Retail Support CREDIT IN TATA PUR']
+        })
+        total_row_2 = round(sr_df2.select_dtypes(include='number').sum(),0)
+        sr_df2.loc[len(sr_df2)] = total_row_2
+
+        sr_df3 = pd.DataFrame()
+        sr_df3['TOTAL ADDL DISC'] = round(
+            sr_df1['Additional Discount'] +
+            sr_df1['Additional Accessories Discount'] +
+            sr_df1['DSA Commission'],0
+        )
+        sr_df3['ADDIL DISC PER CAR'] = round(sr_df3['TOTAL ADDL DISC'] / sr_df1['QTY'],0)
+
+        report.add_frame(sheet_name, pd.DataFrame({f'Location: {i}': ['']}), startrow=current_row, startcol=0)
+        current_row += 2
+
+        report.add_frame(sheet_name, sr_df1, startrow=current_row, startcol=0)
+        report.add_frame(sheet_name, sr_df2, startrow=current_row, startcol=len(sr_df1.columns) + 2)
+        report.add_frame(sheet_name, sr_df3, startrow=current_row, startcol=len(sr_df1.columns) + len(sr_df2.columns) + 4)
+
+        current_row += max(len(sr_df1), len(sr_df2), len(sr_df3)) + row_spacing
+
+    report.autofit(sheet_name)
+
+@profiled('verify_data')
+def verify_data(data, report, aggregates=None):
+    # Location sums with the totals of all rows last; aggregates is computed from data when not given
+    aggregates = aggregates or ChassisAggregates.from_data(data)
+    sheet_name = 'Difference'
+    row_spacing = 2
+    current_row = 1
+    sums = aggregates.by_location().round(0)
+
+    df1 = sums[['Sale Price(+)','Discount-DBT(-)']].rename(columns={'Sale Price(+)':'Sale','Discount-DBT(-)':'Discount'})
+    df1['Net Sale'] = round(df1['Sale'] - df1['Discount'],0)
+    df1['Purchase'] = sums['Purchase Price(-)']
+    df1['Profit'] = round(df1['Net Sale'] - df1['Purchase'],0)
+
+    df2 = sums[['AdditionalDiscount ','TOTAL DLR SHARE','TOTAL TATA SHARE']].copy()
+    df2['Total Discount'] = round(df2['AdditionalDiscount '] + df2['TOTAL DLR SHARE'] + df2['TOTAL TATA SHARE'],0)
+    df2['Discount-DBT(-)'] = sums['Discount-DBT(-)']
+    df2['Difference'] = round(df2['Total Discount'] - df2['Discount-DBT(-)'],0)
+
+    df3 = sums[["TOTAL TATA SHARE","AdditionalFreeAcc(-) ",'DSAComission(-)','Tata DMS Credit']].copy()
+    df3['Balance'] = round(df3['TOTAL TATA SHARE'] - df3['AdditionalFreeAcc(-) '] - df3['DSAComission(-)'] - df3['Tata DMS Credit'],0)
+    total = round(df1['Profit'].iloc[-1] + df3['Balance'].iloc[-1],0)
+    total_margin = sums['Margin'].iloc[-1]
+
+    diff = abs(total-total_margin)
+
+    report.add_frame(sheet_name, df1, startrow=current_row, startcol=0, index=True)
+    current_row += len(df1) + row_spacing
+
+    report.add_frame(sheet_name, df2, startrow=current_row, startcol=0, index=True)
+    current_row += len(df2) + row_spacing
+
+    report.add_frame(sheet_name, df3, startrow=current_row, startcol=0, index=True)
+    current_row += len(df3) + row_spacing
+
+    report.add_frame(sheet_name, pd.DataFrame({f'Total': [total]}), startrow=current_row, startcol=len(df3.columns)-1)
+    current_row += 2
+
+    report.add_frame(sheet_name, pd.DataFrame({f'Total Margin': [total_margin]}), startrow=current_row, startcol=len(df3.columns)-1)
+    current_row += 2
+
+    report.add_frame(sheet_name, pd.DataFrame({f'Difference': [diff]}), startrow=current_row, startcol=len(df3.columns)-1)
+
+    report.autofit(sheet_name)
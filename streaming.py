@@ -0,0 +1,164 @@
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from aggregate import AGGREGATED_COLUMNS, ChassisAggregates
+from export import columnar_dtypes, value_kinds
+from ingest import iter_main_sheet
+from pipeline import (chassis_index, fetching_discount_chassisno, margin_calculation, prepare_data, purchase_sales,
+                      unmatched_chassis)
+from profiling import measure
+from report import ReportBuilder, column_widths, summary, verify_data, zero_total_columns
+
+# Main sheet rows processed at a time by process_chunked()
+CHUNK_ROWS = 50_000
+
+class RunningTotals:
+    """What the reports need from the whole chassis data, updated one chunk at a time.
+
+    Keeps the column totals total_row() would compute, the AGGREGATED_COLUMNS summed
+    per (Location, Model) for ChassisAggregates, the longest cell text per column
+    for the detail sheet and the kinds of values in every column for the exports.
+    With width_sample_rows the text lengths come from that many rows of each chunk,
+    see column_widths().
+    """
+
+    def __init__(self, width_sample_rows=None):
+        self.width_sample_rows = width_sample_rows
+        self.columns = None
+        self.rows = 0
+        self.sums = {}
+        self.non_numeric = set()
+        self.groups = None
+        self.lengths = None
+        self.kinds = {}
+
+    def add(self, chunk):
+        if self.columns is None:
+            self.columns = list(chunk.columns)
+        self.rows += len(chunk)
+        for col in chunk.columns:
+            series = chunk[col]
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+                self.sums[col] = self.sums.get(col, 0) + series.sum()
+            elif series.notna().any():
+                # Text anywhere in the column keeps it out of the totals, as in the full frame
+                self.non_numeric.add(col)
+        for col, kind in value_kinds(chunk).items():
+            self.kinds.setdefault(col, set()).add(kind)
+
+        values = chunk[AGGREGATED_COLUMNS].apply(pd.to_numeric)
+        groups = values.groupby([chunk['Location'], chunk['Model']], dropna=False, sort=False, observed=True).sum()
+        if self.groups is not None:
+            groups = pd.concat([self.groups, groups])
+            groups = groups.groupby(level=[0, 1], dropna=False, sort=False, observed=True).sum()
+        self.groups = groups
+
+        lengths = np.array(column_widths(chunk, count_empty=True, sample_rows=self.width_sample_rows), dtype=np.int64)
+        self.lengths = lengths if self.lengths is None else np.maximum(self.lengths, lengths)
+
+    def totals_row(self):
+        """The row total_row() appends, as a one-row DataFrame with every column"""
+        row = {}
+        for col in self.columns:
+            if col in self.sums and col not in self.non_numeric and col != 'SNO':
+                row[col] = self.sums[col]
+            elif col.lower() == 'sno':
+                row[col] = self.rows
+            elif col.lower() == 'location':
+                row[col] = f'Total ({self.rows})'
+        return pd.DataFrame([row], columns=list(row.keys())).reindex(columns=self.columns)
+
+    def aggregates(self):
+        """The ChassisAggregates of all chunks, as ChassisAggregates.from_data() gives for the whole data"""
+        groups = self.groups
+        if groups is None:
+            index = pd.MultiIndex.from_arrays([[], []], names=['Location', 'Model'])
+            groups = pd.DataFrame(columns=AGGREGATED_COLUMNS, index=index, dtype=float)
+        totals = pd.Series({col: self.sums.get(col, 0) for col in AGGREGATED_COLUMNS})
+        return ChassisAggregates(groups.sort_index(), totals, self.rows)
+
+    def dtypes(self):
+        """The columnar_dtypes() of all chunks, as the exports of the whole data have them"""
+        return columnar_dtypes(self.kinds)
+
+def reconcile_chunk(chunk, index):
+    """reconcile_data() without the totals row, which needs every chunk"""
+    chunk = fetching_discount_chassisno(chunk, index)
+    chunk = purchase_sales(chunk)
+    chunk = margin_calculation(chunk)
+    return chunk.rename(columns={'Total Discount': 'Tata DMS Credit'})
+
+def write_chunked_reports(totals, chunks, output_file, trim_file, max_column_width=None):
+    """Write the complete and trimmed workbooks from spooled chunks and their running totals.
+
+    Returns the ChassisAggregates the Summary and Difference sheets were built from.
+    """
+    totals_frame = totals.totals_row()
+    lengths = np.maximum(totals.lengths, column_widths(totals_frame, header=False, count_empty=True))
+
+    def rows():
+        yield from chunks()
+        yield totals_frame
+
+    with measure('write reports'):
+        report = ReportBuilder(max_column_width=max_column_width)
+        report.add_chunks('Sheet1', totals.columns, rows, totals.rows + 1)
+        report.fit_lengths('Sheet1', lengths)
+        # Same columns chassis_file_trim() keeps: those whose total is not 0
+        report.trim('Sheet1', np.flatnonzero(~zero_total_columns(totals_frame)))
+        aggregates = totals.aggregates()
+        summary(None, report, aggregates)
+        verify_data(None, report, aggregates)
+        report.save(output_file, trim_file)
+    return aggregates
+
+def process_chunked(main_source, main_sheet, sales_reco_data, output_file, trim_file, chunk_rows=CHUNK_ROWS,
+                    spool_dir=None, table_writers=(), width_sample_rows=None, max_column_width=None):
+    """process_data() plus write_reports() for main sheets too large to hold in memory.
+
+    The main sheet is read chunk_rows rows at a time; each chunk runs through the
+    per-row stages, updates the RunningTotals and is spooled to a temporary file in
+    spool_dir (default: the system temp directory). The workbooks are then written
+    by streaming the spooled chunks back, so peak memory depends on chunk_rows, the
+    reconciliation data and the number of Location x Model groups, not on the size
+    of the main sheet. Once the types of every column are known, the spooled chunks
+    are also written to the export TableWriters in table_writers. Returns the number
+    of chassis rows, the unmatched rows and the ChassisAggregates of the chassis data.
+    width_sample_rows and max_column_width size the columns as in build_reports().
+    """
+    index = chassis_index(sales_reco_data)
+    totals = RunningTotals(width_sample_rows)
+    unmatched = []
+    with tempfile.TemporaryDirectory(dir=spool_dir) as spool:
+        paths = []
+        for chunk in iter_main_sheet(main_source, main_sheet, chunk_rows):
+            with measure('chunk') as record:
+                chunk = prepare_data(chunk)
+                missing = unmatched_chassis(chunk, index)
+                if len(missing):
+                    unmatched.append(missing)
+                chunk = reconcile_chunk(chunk, index)
+                totals.add(chunk)
+                record['rows'] = len(chunk)
+            paths.append(os.path.join(spool, f'chunk_{len(paths):06d}.pkl'))
+            chunk.to_pickle(paths[-1])
+            del chunk
+
+        def chunks():
+            for path in paths:
+                yield pd.read_pickle(path)
+
+        if table_writers:
+            with measure('write exports'):
+                dtypes = totals.dtypes()
+                for chunk in chunks():
+                    for writer in table_writers:
+                        writer.write(chunk, dtypes)
+        aggregates = write_chunked_reports(totals, chunks, output_file, trim_file, max_column_width)
+    # Empty frames are left out of the concat; without any unmatched row the last chunk's
+    # empty frame has the columns
+    unmatched = pd.concat(unmatched, ignore_index=True) if unmatched else missing.reset_index(drop=True)
+    return totals.rows, unmatched, aggregates
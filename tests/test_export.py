@@ -0,0 +1,67 @@
+"""Chunked exports of process_chunked() against the export of the whole chassis data.
+
+The main sheet has a column that holds numbers in its first chunk and text in a later
+one, and a column that is blank in its first chunk, so the chunks differ in type.
+"""
+import io
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from export import EXPORT_FORMATS, TableWriter, chassis_rows, write_table
+from ingest import MAIN_SHEET_SKIPROWS, read_main_sheet, read_reco_sheet
+from pipeline import process_data, pyarrow_available
+from streaming import process_chunked
+
+HEADER = ['SNO', 'Location', 'Model', 'ChassisNo', 'COUNT', 'GST%', 'CESS%', 'Sale Price(+)', 'Purchase Price(-)',
+          'Discount-DBT(-)', 'AdditionalDiscount', 'AdditionalFreeAcc(-)', 'DSAComission(-)', 'Mixed', 'Late']
+ROWS = 10
+CHUNK_ROWS = 4
+
+def main_row(i):
+    mixed = 'x' if i == 6 else i * 10
+    late = None if i < CHUNK_ROWS else i + 0.5
+    return [i + 1, f'LOC{i % 2}', f'MODEL {i % 3}', f'CH{i:04d}', 1, 28, 1, 900000 + i, 800000, 1000, 500, 100, 50,
+            mixed, late]
+
+@pytest.fixture
+def workbooks(tmp_path):
+    main = Workbook()
+    for _ in range(MAIN_SHEET_SKIPROWS):
+        main.active.append(['Report'])
+    main.active.append(HEADER)
+    for i in range(ROWS):
+        main.active.append(main_row(i))
+    main.save(tmp_path / 'main.xlsx')
+    reco = Workbook()
+    reco.active.append(['Chassis_No', 'Total Discount'])
+    for i in range(ROWS):
+        reco.active.append([f'CH{i:04d}', 1000 + i])
+    reco.save(tmp_path / 'reco.xlsx')
+    return tmp_path / 'main.xlsx', tmp_path / 'reco.xlsx'
+
+def read_export(content, fmt):
+    return pd.read_csv(io.BytesIO(content)) if fmt == 'csv' else pd.read_parquet(io.BytesIO(content))
+
+@pytest.mark.parametrize('fmt', EXPORT_FORMATS)
+def test_chunked_export_matches_whole_data(workbooks, fmt):
+    if fmt == 'parquet' and not pyarrow_available():
+        pytest.skip('pyarrow is not installed')
+    main_file, reco_file = workbooks
+    reco = read_reco_sheet(reco_file, 0)
+
+    data, _unmatched = process_data(read_main_sheet(main_file, 0), reco)
+    whole = io.BytesIO()
+    write_table(chassis_rows(data), whole, fmt)
+
+    chunked = io.BytesIO()
+    with TableWriter(chunked, fmt) as writer:
+        process_chunked(main_file, 0, reco, io.BytesIO(), io.BytesIO(), CHUNK_ROWS, table_writers=[writer])
+
+    if fmt == 'csv':
+        assert chunked.getvalue() == whole.getvalue()
+    expected = read_export(whole.getvalue(), fmt)
+    pd.testing.assert_frame_equal(read_export(chunked.getvalue(), fmt), expected)
+    assert expected['Mixed'].tolist()[5:8] == ['50', 'x', '70']
+    assert pd.api.types.is_float_dtype(expected['Late'])
@@ -0,0 +1,120 @@
+"""read_header() and sheet_names(), which read workbooks without openpyxl, against pandas.
+
+The pre-flight column checks run on every upload, so their headers have to name the
+same columns read_excel() finds, or valid files would be rejected.
+"""
+import re
+import zipfile
+from xml.sax.saxutils import escape, unescape
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from ingest import (MAIN_SHEET_SKIPROWS, RECO_COLUMNS, REQUIRED_MAIN_COLUMNS, missing_columns, missing_main_columns,
+                    missing_reco_columns, read_header, sheet_names)
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+# Header rows of the main sheet, None for blank cells
+MAIN_HEADERS = {
+    'complete': ['SNO'] + REQUIRED_MAIN_COLUMNS + ['Remark'],
+    'numeric': ['SNO', 2024, 3.5] + REQUIRED_MAIN_COLUMNS,
+    'missing': [col for col in REQUIRED_MAIN_COLUMNS if col != 'COUNT'],
+    'gap': REQUIRED_MAIN_COLUMNS[:3] + [None, None] + REQUIRED_MAIN_COLUMNS[3:],
+    'short': REQUIRED_MAIN_COLUMNS[:4],
+    'blank': [],
+}
+RECO_HEADERS = {
+    'complete': ['Sno', 'Chassis_No', 'Total Discount', 'Other'],
+    'missing': ['Chassis_No', 'Discount'],
+}
+DATA_COLUMNS = len(REQUIRED_MAIN_COLUMNS) + 5
+
+def shared_strings(path):
+    # Move the text cells of every worksheet, which openpyxl writes inline, to a shared strings table
+    with zipfile.ZipFile(path) as archive:
+        parts = {name: archive.read(name).decode() for name in archive.namelist()}
+    strings = []
+
+    def shared(match):
+        text = unescape(match[3])
+        if text not in strings:
+            strings.append(text)
+        return f'<c{match[1]} t="s"{match[2]}><v>{strings.index(text)}</v></c>'
+
+    for name in parts:
+        if name.startswith('xl/worksheets/'):
+            parts[name] = re.sub(r'<c([^>]*?) t="inlineStr"([^>]*)><is><t[^>]*>(.*?)</t></is></c>', shared, parts[name])
+    items = ''.join(f'<si><t>{escape(text)}</t></si>' for text in strings)
+    parts['xl/sharedStrings.xml'] = (f'<sst xmlns="{_MAIN_NS[1:-1]}" count="{len(strings)}" '
+                                     f'uniqueCount="{len(strings)}">{items}</sst>')
+    parts['xl/_rels/workbook.xml.rels'] = parts['xl/_rels/workbook.xml.rels'].replace('</Relationships>', (
+        '<Relationship Id="rIdStrings" Target="sharedStrings.xml" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/sharedStrings" /></Relationships>'))
+    parts['[Content_Types].xml'] = parts['[Content_Types].xml'].replace('</Types>', (
+        '<Override PartName="/xl/sharedStrings.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml" /></Types>'))
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, content in parts.items():
+            archive.writestr(name, content)
+
+def write_workbook(path, sheets, shared):
+    """Workbook with a sheet of rows per name in sheets, its text in a shared strings table with shared"""
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name, rows in sheets.items():
+        ws = wb.create_sheet(name)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+    if shared:
+        shared_strings(path)
+    return path
+
+def main_rows(header):
+    return [['Report']] * MAIN_SHEET_SKIPROWS + [header] + [list(range(DATA_COLUMNS))] * 2
+
+def excel_header(path, sheet_name, skiprows=0):
+    return list(pd.read_excel(path, sheet_name=sheet_name, skiprows=skiprows, nrows=0).columns)
+
+@pytest.mark.parametrize('shared', [True, False], ids=['shared', 'inline'])
+@pytest.mark.parametrize('case', MAIN_HEADERS)
+def test_main_header_matches_read_excel(tmp_path, case, shared):
+    header = MAIN_HEADERS[case]
+    path = write_workbook(tmp_path / 'main.xlsx', {
+        'Notes': [['Dealer report'], ['Location', 'Model']],
+        'Sales': main_rows(header),
+    }, shared)
+
+    for sheet_name in ['Sales', 1]:
+        expected = excel_header(path, sheet_name, MAIN_SHEET_SKIPROWS)
+        assert missing_main_columns(path, sheet_name) == missing_columns(expected, REQUIRED_MAIN_COLUMNS)
+        if None not in header:
+            assert read_header(path, sheet_name, MAIN_SHEET_SKIPROWS) == expected
+        else:
+            # Blank cells are '' where read_excel names them 'Unnamed: <position>'
+            assert read_header(path, sheet_name, MAIN_SHEET_SKIPROWS) == ['' if col is None else col for col in header]
+    assert missing_main_columns(path, 'Sales') == {
+        'complete': [], 'numeric': [], 'missing': ['COUNT'], 'gap': [], 'short': REQUIRED_MAIN_COLUMNS[4:],
+        'blank': REQUIRED_MAIN_COLUMNS,
+    }[case]
+
+@pytest.mark.parametrize('shared', [True, False], ids=['shared', 'inline'])
+@pytest.mark.parametrize('case', RECO_HEADERS)
+def test_reco_header_matches_read_excel(tmp_path, case, shared):
+    path = write_workbook(tmp_path / 'reco.xlsx', {
+        'PV': [RECO_HEADERS[case], [1, 'CH0001', 1000.0, 0]],
+        'Other': [['a'], [1]],
+    }, shared)
+
+    for sheet_name in ['PV', 0]:
+        expected = excel_header(path, sheet_name)
+        assert read_header(path, sheet_name) == expected
+        assert missing_reco_columns(path, sheet_name) == missing_columns(expected, RECO_COLUMNS)
+    assert missing_reco_columns(path, 'PV') == ([] if case == 'complete' else ['Total Discount'])
+
+def test_sheet_names_match_read_excel(tmp_path):
+    sheets = {'Sales': [['a']], 'PV & Other': [['b']], 'Notes': [['c']]}
+    path = write_workbook(tmp_path / 'book.xlsx', sheets, shared=True)
+    assert sheet_names(path) == pd.ExcelFile(path).sheet_names == list(sheets)
@@ -0,0 +1,64 @@
+"""ChassisIndex lookups, built, updated and reopened, against the merge they replaced, on random sheets."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline import fetching_discount_chassisno
+from reco_index import ChassisIndex
+
+# The discount join as it was before ChassisIndex, kept as the reference output
+def legacy_fetching_discount_chassisno(data, sales_reco_data):
+    clean_sales = sales_reco_data[['Chassis_No', 'Total Discount']].copy()
+    clean_sales = clean_sales.dropna(subset=['Chassis_No'])
+    clean_sales = (
+        clean_sales.sort_values(by='Total Discount', na_position='last')
+        .drop_duplicates(subset='Chassis_No', keep='first')
+    )
+    chassis_to_discount = dict(zip(clean_sales['Chassis_No'], clean_sales['Total Discount']))
+    data_filtered = data[data['ChassisNo'].isin(chassis_to_discount.keys())].copy()
+    data_filtered['Total Discount'] = data_filtered['ChassisNo'].map(chassis_to_discount)
+    data_filtered['Total Discount'] = data_filtered['Total Discount'] * data_filtered['COUNT']
+    return data_filtered
+
+CHASSIS = [f'CH{i:04d}' for i in range(60)]
+
+def random_reco(rng):
+    # Duplicate chassis, rows without a chassis number and blank discounts
+    rows = rng.integers(1, 80)
+    chassis = rng.choice(CHASSIS[:50] + [None], rows)
+    discounts = rng.choice([0.0, 1000.0, 2500.0, 4000.0, np.nan], rows)
+    return pd.DataFrame({'Chassis_No': chassis, 'Total Discount': discounts, 'Other': 0})
+
+def random_main(rng):
+    rows = 40
+    return pd.DataFrame({'SNO': np.arange(1, rows + 1), 'ChassisNo': rng.choice(CHASSIS, rows),
+                         'COUNT': rng.choice([1, 1, -1], rows)})
+
+def merged_reco(earlier, later):
+    # What an index updated with earlier, then later holds: later's chassis replace earlier's
+    kept = earlier[~earlier['Chassis_No'].isin(later['Chassis_No'].dropna())]
+    return pd.concat([later, kept], ignore_index=True)
+
+@pytest.mark.parametrize('seed', range(100))
+def test_index_matches_legacy_join(seed):
+    rng = np.random.default_rng(seed)
+    main, reco = random_main(rng), random_reco(rng)
+    expected = legacy_fetching_discount_chassisno(main.copy(), reco)
+    pd.testing.assert_frame_equal(fetching_discount_chassisno(main.copy(), reco), expected)
+    pd.testing.assert_frame_equal(fetching_discount_chassisno(main.copy(), ChassisIndex.from_sheet(reco)), expected)
+
+@pytest.mark.parametrize('seed', range(100))
+def test_updated_and_reopened_index_match_legacy_join(seed, tmp_path):
+    rng = np.random.default_rng(seed)
+    main, earlier, later = random_main(rng), random_reco(rng), random_reco(rng)
+    path = tmp_path / 'chassis.sqlite'
+    index = ChassisIndex.open(path)
+    index.update(earlier)
+    index.update(later)
+    assert index.update(later) == 0
+
+    expected = legacy_fetching_discount_chassisno(main.copy(), merged_reco(earlier, later))
+    pd.testing.assert_frame_equal(fetching_discount_chassisno(main.copy(), index), expected)
+    reopened = ChassisIndex.open(path)
+    assert len(reopened) == len(index)
+    pd.testing.assert_frame_equal(fetching_discount_chassisno(main.copy(), reopened), expected)
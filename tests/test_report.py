@@ -0,0 +1,81 @@
+"""Column widths of the workbooks with row sampling and a width cap, for very large sheets."""
+import io
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+
+import cli
+from ingest import MAIN_SHEET_SKIPROWS
+from report import ReportBuilder, column_widths
+
+HEADER = ['SNO', 'Location', 'Model', 'ChassisNo', 'COUNT', 'GST%', 'CESS%', 'Sale Price(+)', 'Purchase Price(-)',
+          'Discount-DBT(-)', 'AdditionalDiscount', 'AdditionalFreeAcc(-)', 'DSAComission(-)', 'Remark']
+ROWS = 100
+# Row whose Remark is longer than every other cell; not among 5 evenly spaced rows of the
+# sheet, with or without its totals row, nor of its 40-row chunk
+LONG_ROW = 52
+LONG_REMARK = 'x' * 80
+
+def detail_widths(output_dir):
+    # {header: width} of Sheet1 of the complete workbook the CLI wrote to output_dir
+    path, = output_dir.glob('*_main_chassis.xlsx')
+    ws = load_workbook(path)['Sheet1']
+    return {cell.value: ws.column_dimensions[cell.column_letter].width for cell in ws[1]}
+
+def sheet_widths(target, sheet_name):
+    ws = load_workbook(target)[sheet_name]
+    return {letter: dim.width for letter, dim in ws.column_dimensions.items()}
+
+def test_sampled_widths_measure_evenly_spaced_rows():
+    frame = pd.DataFrame({'Remark': [f'r{i}' for i in range(ROWS)]})
+    frame.loc[LONG_ROW, 'Remark'] = LONG_REMARK
+    assert column_widths(frame, sample_rows=5) == column_widths(frame.iloc[[0, 24, 49, 74, 99]])
+    assert column_widths(frame, sample_rows=5) == [len('Remark')]
+    assert column_widths(frame) == [len(LONG_REMARK)]
+    # Sheets no longer than sample_rows are measured in full
+    assert column_widths(frame, sample_rows=ROWS) == column_widths(frame)
+
+def test_max_column_width_caps_widths():
+    frame = pd.DataFrame({'Remark': ['short', LONG_REMARK], 'Model': ['A', 'B']})
+    report = ReportBuilder(max_column_width=30)
+    report.add_frame('Sheet1', frame)
+    report.autofit('Sheet1')
+    output = io.BytesIO()
+    report.save(output)
+    assert sheet_widths(output, 'Sheet1') == {'A': 30, 'B': len('Model') + 2}
+
+@pytest.fixture
+def main_file(tmp_path):
+    main = Workbook()
+    for _ in range(MAIN_SHEET_SKIPROWS):
+        main.active.append(['Report'])
+    main.active.append(HEADER)
+    for i in range(ROWS):
+        remark = LONG_REMARK if i == LONG_ROW else f'r{i}'
+        main.active.append([i + 1, 'LOC1', 'MODEL A', f'CH{i:04d}', 1, 28, 1, 900000, 800000, 1000, 500, 100, 50,
+                            remark])
+    main.save(tmp_path / 'main.xlsx')
+    reco = Workbook()
+    reco.active.append(['Chassis_No', 'Total Discount'])
+    for i in range(ROWS):
+        reco.active.append([f'CH{i:04d}', 1000])
+    reco.save(tmp_path / 'reco.xlsx')
+    return tmp_path / 'main.xlsx'
+
+@pytest.mark.parametrize('chunk_rows', [None, 40])
+def test_cli_width_options(main_file, tmp_path, chunk_rows):
+    args = ['--main', str(main_file), '--reco', str(tmp_path / 'reco.xlsx'), '--workers', '1']
+    if chunk_rows:
+        args += ['--chunk-rows', str(chunk_rows)]
+
+    assert cli.main(args + ['--output-dir', str(tmp_path / 'full')]) == 0
+    assert detail_widths(tmp_path / 'full')['Remark'] == len(LONG_REMARK) + 2
+
+    assert cli.main(args + ['--output-dir', str(tmp_path / 'capped'), '--max-column-width', '30']) == 0
+    widths = detail_widths(tmp_path / 'capped')
+    assert widths['Remark'] == 30 and max(widths.values()) <= 30
+
+    assert cli.main(args + ['--output-dir', str(tmp_path / 'sampled'), '--width-sample-rows', '5']) == 0
+    widths = detail_widths(tmp_path / 'sampled')
+    assert widths['Remark'] < len(LONG_REMARK) + 2
@@ -0,0 +1,60 @@
+"""share_calculation() against the per-rule functions it replaced, on random headers."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline import gst_calculation, share_calculation
+
+# The share stages as they were before the rule table, kept as the reference output
+def legacy_additional_columns(data):
+    additional_cols = [i for i in data.columns if "Additional" in i]
+    for col in additional_cols:
+        data[col + " "] = round(data[col] * 100 / data['gst'], 0)
+    return data
+
+def legacy_dlr_calculation(data):
+    total = 0
+    dlr_cols = [i for i in data.columns if "dlr" in i.lower() or "dealer" in i.lower()]
+    for col in dlr_cols:
+        data[col + " "] = round(data[col] * 100 / data['gst'], 0)
+        total += data[col + " "]
+    data['TOTAL DLR SHARE'] = total
+    return data
+
+def legacy_tata_share_calculation(data):
+    total = 0
+    tata_mfr_cols = [i for i in data.columns if "tata" in i.lower() or "mfr" in i.lower() or "mfg" in i.lower() or "manuf(+)" in i.lower()]
+    for col in tata_mfr_cols:
+        data[col + " "] = round(data[col] * 100 / data['gst'], 0)
+        total += data[col + " "]
+    data['TOTAL TATA SHARE'] = total
+    return data
+
+# Header names that match no rule, one rule, several rules, or a rule's own output
+HEADER_POOL = ['COUNT', 'Sale Price(+)', 'Model', 'AdditionalDiscount', 'AdditionalFreeAcc(-)', 'additional lower',
+               'Exchange Dlr Share(+)', 'Corporate Dealer Share(+)', 'DEALER bonus', 'Exchange Tata Share(+)',
+               'Loyalty Mfr Share(+)', 'Scrap Mfg Share(+)', 'Manuf(+) credit', 'Additional Dlr Share',
+               'Additional Tata Share', 'Dlr Tata Share', 'Additional Dealer Mfr', 'TOTAL DLR SHARE',
+               'TOTAL TATA SHARE']
+
+def random_sheet(seed):
+    rng = np.random.default_rng(seed)
+    names = list(rng.choice(HEADER_POOL, size=rng.integers(1, 10), replace=False))
+    # Normalized copies already in the sheet, sometimes several levels deep
+    for name in list(names):
+        depth = rng.choice([0, 0, 1, 2])
+        names += [name + ' ' * level for level in range(1, depth + 1)]
+    names = list(rng.permutation(names)) + ['GST%', 'CESS%']
+    rows = 20
+    data = {name: rng.integers(-50_000, 50_000, rows).astype(float) for name in names}
+    data['GST%'] = rng.choice([5.0, 12.0, 18.0, 28.0], rows)
+    data['CESS%'] = rng.choice([0.0, 1.0, 15.0, 22.0], rows)
+    return pd.DataFrame(data)
+
+@pytest.mark.parametrize('seed', range(400))
+def test_share_calculation_matches_legacy_stages(seed):
+    sheet = random_sheet(seed)
+    expected = legacy_tata_share_calculation(legacy_dlr_calculation(legacy_additional_columns(
+        gst_calculation(sheet.copy()))))
+    result = share_calculation(gst_calculation(sheet.copy()))
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+
+from report import ReportBuilder
+
+# Trend workbook sheets summed from the history store: sheet name -> stored measure
+TREND_MEASURES = {'QTY': 'COUNT', 'Net Margin': 'Margin'}
+
+def period_sums(store, dealer, periods=None):
+    """{sheet name: DataFrame} of TREND_MEASURES per (Location, Model) with one column per period.
+
+    Reads the stored sums of dealer's runs in one query instead of reprocessing their
+    workbooks; periods defaults to every stored month. Rows missing either key are left
+    out, as on the Summary sheet, and models not sold in a period count as 0 there.
+    """
+    rows = store.sums(dealer, list(TREND_MEASURES.values()), periods)
+    if rows.empty:
+        raise ValueError(f"No stored runs of dealer {dealer!r} for the requested periods")
+    # Oldest period first; 'YYYY-MM' sorts by date
+    columns = sorted(rows['period'].unique())
+    rows = rows.dropna(subset=['location', 'model'])
+    table = rows.pivot_table(index=['location', 'model'], columns=['measure', 'period'], values='value',
+                             aggfunc='sum', fill_value=0)
+    table.index.names = ['Location', 'Model']
+    sums = {}
+    for name, measure in TREND_MEASURES.items():
+        values = table[measure] if measure in table.columns.get_level_values(0) else pd.DataFrame(index=table.index)
+        sums[name] = values.reindex(columns=columns, fill_value=0)
+    return sums
+
+def with_totals(values):
+    """values with a TOTAL row after each Location's models and a grand TOTAL row last"""
+    locations = values.groupby(level='Location', sort=True).sum()
+    locations.index = pd.MultiIndex.from_arrays([locations.index, ['TOTAL'] * len(locations)],
+                                                names=values.index.names)
+    combined = pd.concat([values, locations])
+    is_total = np.r_[np.zeros(len(values), dtype=bool), np.ones(len(locations), dtype=bool)]
+    keys = combined.index.to_frame(index=False)
+    order = np.lexsort((keys['Model'].astype(str), is_total, keys['Location'].astype(str)))
+    grand = pd.DataFrame([values.sum()], index=pd.MultiIndex.from_tuples([('TOTAL', '')], names=values.index.names))
+    return pd.concat([combined.iloc[order], grand])
+
+def with_deltas(table):
+    """table followed by the change of every period from the one before it"""
+    deltas = table.diff(axis=1).iloc[:, 1:]
+    deltas.columns = [f'Δ {period}' for period in table.columns[1:]]
+    return pd.concat([table, deltas], axis=1)
+
+def trend_report(sums):
+    """ReportBuilder of the trend workbook: QTY, Net Margin and Per Car Margin sheets.
+
+    Every sheet has a row per (Location, Model) with Location and grand totals, a column
+    per period and the change between consecutive periods. Per Car Margin is left blank
+    where no car was sold.
+    """
+    qty = with_totals(sums['QTY'])
+    margin = with_totals(sums['Net Margin'])
+    sheets = {
+        'QTY': qty,
+        'Net Margin': margin.round(0),
+        'Per Car Margin': (margin / qty.where(qty != 0)).round(0),
+    }
+    report = ReportBuilder()
+    for sheet_name, table in sheets.items():
+        report.add_frame(sheet_name, with_deltas(table).reset_index())
+        report.autofit(sheet_name)
+    return report
+
+def write_trend(store, dealer, target, periods=None):
+    """Write dealer's trend workbook across periods to a file path or binary file object; returns its periods"""
+    sums = period_sums(store, dealer, periods)
+    trend_report(sums).save(target)
+    return list(sums['QTY'].columns)